@@ -0,0 +1,135 @@
+from app.incremental import AGGREGATE_CALL, FACT_REF, FACT_TABLE, fact_reference
+from app.sqltools import mask_nested, select_items, select_list_span, top_level_clause
+from statistics import NormalDist
+import logging
+import math
+import re
+
+logger = logging.getLogger(__name__)
+APPROX_SETTINGS = {}
+
+ESTIMABLE = re.compile(r"^\s*(?:coalesce\s*\(\s*)?(sum|count|avg)\s*\(\s*(distinct\s+)?(.*?)\)"
+                       r"(?:\s*,\s*[^,()]+\s*\))?\s*(?:(?:as\s+)?\"?\w+\"?)?\s*$", re.I | re.S)
+# HAVING would filter on unscaled sample aggregates.
+_UNSUPPORTED = re.compile(r"\b(having|union|intersect|except|window)\b", re.I)
+
+
+class SamplePlan:
+    def __init__(self, kinds, aux):
+        # kinds[i] is "key", "sum", "count" or "avg" for output column i;
+        # aux[i] the extra sample statistics that column's variance needs.
+        self.kinds = kinds
+        self.aux = aux
+
+
+def plan_sample(sql: str):
+    # A SamplePlan when the statement aggregates the sales table with
+    # SUM/COUNT/AVG only, which scale from a Bernoulli sample; else None.
+    masked = mask_nested(sql)
+    if re.match(r"\s*with\b", masked, re.I) or _UNSUPPORTED.search(masked) or re.search(r"\bover\s*\(", sql, re.I):
+        return None
+    if len(FACT_REF.findall(sql)) != 1 or re.search(r"\btablesample\b", sql, re.I):
+        return None
+    items = select_items(sql)
+    if not items or any(item.endswith("*") for item in items):
+        return None
+    outer_join = re.search(r"\b(left|right|full)\s+(outer\s+)?join\b", masked, re.I)
+
+    kinds, aux = [], []
+    for item in items:
+        match = ESTIMABLE.match(item)
+        if match and not AGGREGATE_CALL.search(match.group(3)):
+            func, distinct, arg = match.group(1).lower(), match.group(2), match.group(3).strip()
+            if distinct or (func == "count" and arg == "*" and outer_join):
+                return None
+            kinds.append(func)
+            if func == "sum":
+                aux.append([f"sum((({arg}))::float8 ^ 2)"])
+            elif func == "avg":
+                aux.append([f"var_samp(({arg})::float8)", f"count({arg})"])
+            else:
+                aux.append([])
+        elif AGGREGATE_CALL.search(item):
+            return None
+        else:
+            kinds.append("key")
+            aux.append([])
+    if all(k == "key" for k in kinds):
+        return None
+    if "key" in kinds and top_level_clause(sql, r"group\s+by", ("order", "limit")) is None:
+        return None
+    return SamplePlan(kinds, aux)
+
+
+def sampled_sql(sql: str, plan: SamplePlan, percent: float, method: str = "BERNOULLI", seed: int = 0) -> str:
+    # Adds the variance inputs to the SELECT list and samples the fact table
+    # (TABLESAMPLE goes after the table's alias).
+    extra = [f"{expr} AS __approx_{i}_{j}" for i, exprs in enumerate(plan.aux) for j, expr in enumerate(exprs)]
+    _, list_end = select_list_span(sql)
+    if extra:
+        sql = f"{sql[:list_end].rstrip()}, {', '.join(extra)} {sql[list_end:]}"
+    match, end, alias = fact_reference(sql)
+    return f"{sql[:end]} TABLESAMPLE {method} ({percent:.6g}) REPEATABLE ({int(seed)}){sql[end:]}"
+
+
+def estimate_rows(plan: SamplePlan, columns: list, rows: list, fraction: float, z: float):
+    # Scales the sample aggregates to the full table and appends a
+    # <column>_margin (half-width of the confidence interval) per estimate.
+    # Variances are those of the Horvitz-Thompson estimator under Bernoulli
+    # sampling, so margins of disjoint groups combine as sqrt(sum(m^2)).
+    width = len(plan.kinds)
+    index = {name: i for i, name in enumerate(columns)}
+    estimated = [i for i, kind in enumerate(plan.kinds) if kind != "key"]
+    out_columns = columns[:width] + [f"{columns[i]}_margin" for i in estimated]
+    out_rows = []
+    for row in rows:
+        values = list(row[:width])
+        margins = []
+        for i in estimated:
+            kind, value = plan.kinds[i], row[i]
+            if kind == "sum":
+                values[i] = float(value) / fraction if value is not None else None
+                squares = row[index[f"__approx_{i}_0"]] or 0.0
+                variance = (1 - fraction) / fraction ** 2 * squares
+            elif kind == "count":
+                values[i] = round(value / fraction)
+                variance = (1 - fraction) / fraction ** 2 * value
+            else:
+                values[i] = float(value) if value is not None else None
+                sample_var, n = row[index[f"__approx_{i}_0"]], row[index[f"__approx_{i}_1"]]
+                variance = (1 - fraction) * sample_var / n if sample_var is not None and n else None
+            margins.append(z * math.sqrt(variance) if variance is not None else None)
+        out_rows.append(values + margins)
+    return out_columns, out_rows
+
+
+def init_approximate(config: dict):
+    global APPROX_SETTINGS
+    APPROX_SETTINGS = {
+        "min_rows": int(config.get("APPROX_MIN_ROWS", 1000000)),
+        "target_rows": int(config.get("APPROX_TARGET_SAMPLE_ROWS", 100000)),
+        "method": config.get("APPROX_SAMPLE_METHOD", "BERNOULLI").upper(),
+        "z": NormalDist().inv_cdf(0.5 + float(config.get("APPROX_CONFIDENCE", 0.95)) / 2),
+    }
+    if APPROX_SETTINGS["method"] not in ("BERNOULLI", "SYSTEM"):
+        raise ValueError(f"Unknown APPROX_SAMPLE_METHOD: {APPROX_SETTINGS['method']}")
+
+def approximate(sql: str, run_query, estimated_rows):
+    # Returns (mode, columns, rows, percent): "sampled" with scaled values and
+    # margins, "exact" when the fact table is small enough to scan, or
+    # "unsupported" when the statement can't be scaled from a sample.
+    plan = plan_sample(sql) if APPROX_SETTINGS else None
+    if plan is None:
+        columns, rows = run_query(sql)
+        return "unsupported", columns, rows, 100.0
+    total = estimated_rows(FACT_TABLE)
+    if not total or total < APPROX_SETTINGS["min_rows"]:
+        columns, rows = run_query(sql)
+        return "exact", columns, rows, 100.0
+
+    fraction = min(1.0, APPROX_SETTINGS["target_rows"] / total)
+    percent = fraction * 100
+    columns, rows = run_query(sampled_sql(sql, plan, percent, APPROX_SETTINGS["method"]))
+    columns, rows = estimate_rows(plan, columns, rows, fraction, APPROX_SETTINGS["z"])
+    logger.info(f"Approximated over a {percent:.3g}% sample of ~{total:.0f} {FACT_TABLE} rows.")
+    return "sampled", columns, rows, percent
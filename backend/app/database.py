@@ -1,36 +1,297 @@
-from psycopg2 import pool
+from psycopg2 import pool, errors
+import psycopg2
+from app.metrics import stage, POOL_IN_USE, POOL_MAX, REPLICA_LAG, ROUTED_QUERIES
+from app.encoding import register_fast_types
+from app.results import fetch_rows
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
 import logging
 
 logger = logging.getLogger(__name__)
 DB_POOL = None
+READ_REPLICAS = []
+# None until the first lookup tells us whether the trigger-maintained
+# table_versions table (sql/table_versions.sql) is installed.
+_HAS_VERSION_TABLE = None
+_MAX_REPLICA_LAG = 5.0
+_LAG_MONITOR = None
+_LAG_STOP = threading.Event()
+_ROUTING_LOCK = threading.Lock()
+# The pool reads are pinned to inside consistent_reads(), once the first one picks it.
+_PINNED_POOL = ContextVar("pinned_pool", default=None)
+
+# Streaming replicas report zero lag when they've replayed everything they
+# received; otherwise lag is the age of the last replayed transaction.
+# Servers that aren't standbys report zero.
+LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class ManagedPool:
+    # psycopg2's pools raise PoolError when exhausted; the semaphore makes
+    # callers queue for a free connection instead (bounded by DB_POOL_TIMEOUT).
+    # The API only reads, so with DB_READ_ONLY every transaction defaults to
+    # READ ONLY and a statement slipping past sqltools.single_statement can't
+    # write. A session can still SET it back; a SELECT-only DB_USER can't.
+    def __init__(self, name: str, config: dict, defaults: dict = None):
+        settings = dict(defaults or {}, **config)
+        options = "-c standard_conforming_strings=on"
+        if settings.get("DB_READ_ONLY", True):
+            options += " -c default_transaction_read_only=on"
+        self.name = name
+        self.pool = pool.ThreadedConnectionPool(
+            minconn=int(settings.get("DB_POOL_MIN", 1)),
+            maxconn=int(settings.get("DB_POOL_MAX", 10)),
+            host=settings.get("DB_HOST", "localhost"),
+            port=settings.get("DB_PORT", "5432"),
+            dbname=settings.get("DB_NAME"),
+            user=settings.get("DB_USER"),
+            password=settings.get("DB_PASSWORD"),
+            options=options
+        )
+        self.maxconn = self.pool.maxconn
+        self.timeout = float(settings.get("DB_POOL_TIMEOUT", 30))
+        self.slots = threading.BoundedSemaphore(self.maxconn)
+        self.outstanding = 0
+        self.lag = 0.0
+        POOL_MAX.set(self.maxconn, pool=name)
+
+    def getconn(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise pool.PoolError(f"No {self.name} connection available after {self.timeout}s")
+        try:
+            return self.pool.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            self.pool.putconn(conn)
+        finally:
+            self.slots.release()
+
+    def closeall(self):
+        self.pool.closeall()
+
 
 def init_db_pool(config: dict):
-    global DB_POOL
-    DB_POOL = pool.SimpleConnectionPool(
-        minconn=1,
-        maxconn=10,
-        host=config.get("DB_HOST", "localhost"),
-        port=config.get("DB_PORT", "5432"),
-        dbname=config.get("DB_NAME"),
-        user=config.get("DB_USER"),
-        password=config.get("DB_PASSWORD")
-    )
+    global DB_POOL, READ_REPLICAS, _MAX_REPLICA_LAG, _LAG_MONITOR
+    DB_POOL = ManagedPool("primary", config)
     logger.info("Database connection pool created.")
 
+    READ_REPLICAS = []
+    for i, replica in enumerate(config.get("DB_READ_REPLICAS", [])):
+        try:
+            READ_REPLICAS.append(ManagedPool(f"replica{i}", replica, config))
+        except psycopg2.OperationalError as e:
+            logger.error(f"Skipping unreachable read replica {i}: {e}")
+    if READ_REPLICAS:
+        _MAX_REPLICA_LAG = float(config.get("REPLICA_MAX_LAG_SECONDS", 5))
+        interval = float(config.get("REPLICA_LAG_CHECK_SECONDS", 2))
+        check_replica_lag()
+        _LAG_STOP.clear()
+        _LAG_MONITOR = threading.Thread(target=_monitor_lag, args=(interval,), name="replica-lag", daemon=True)
+        _LAG_MONITOR.start()
+        logger.info(f"Read replica pools created: {[r.name for r in READ_REPLICAS]}")
+
 def close_db_pool():
-    global DB_POOL
+    global DB_POOL, READ_REPLICAS
+    _LAG_STOP.set()
+    for replica in READ_REPLICAS:
+        replica.closeall()
+    READ_REPLICAS = []
     if DB_POOL:
         DB_POOL.closeall()
         logger.info("Database connections closed.")
 
-def run_query(query: str):
-    conn = DB_POOL.getconn()
+def check_replica_lag():
+    for replica in READ_REPLICAS:
+        try:
+            conn = replica.getconn()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(LAG_QUERY)
+                    replica.lag = float(cur.fetchone()[0])
+                conn.rollback()
+            finally:
+                replica.putconn(conn)
+        except Exception as e:
+            replica.lag = float("inf")
+            logger.warning(f"Lag check failed for {replica.name}: {e}")
+        REPLICA_LAG.set(replica.lag if replica.lag != float("inf") else -1, pool=replica.name)
+
+def _monitor_lag(interval: float):
+    while not _LAG_STOP.wait(interval):
+        check_replica_lag()
+
+def choose_pool(readonly: bool) -> ManagedPool:
+    # Least outstanding requests among replicas within the lag budget;
+    # writes, and reads when no replica qualifies, go to the primary.
+    if not readonly or not READ_REPLICAS:
+        return DB_POOL
+    candidates = [r for r in READ_REPLICAS if r.lag <= _MAX_REPLICA_LAG]
+    if not candidates:
+        return DB_POOL
+    return min(candidates, key=lambda r: r.outstanding / r.maxconn)
+
+@contextmanager
+def consistent_reads():
+    # Every read inside the block goes to the same server, so table versions
+    # and the data they label never come from replicas with different lag.
+    # A replica only moves forward, so the data is at least as new as the
+    # versions read before it (an ETag may undersell it, never oversell it).
+    token = _PINNED_POOL.set({})
     try:
-        cur = conn.cursor()
-        cur.execute(query)
+        yield
+    finally:
+        _PINNED_POOL.reset(token)
+
+def _pin(target: ManagedPool):
+    pinned = _PINNED_POOL.get()
+    if pinned is not None:
+        pinned["pool"] = target
+
+@contextmanager
+def connection(readonly: bool = False):
+    with _ROUTING_LOCK:
+        pinned = _PINNED_POOL.get() if readonly else None
+        target = (pinned or {}).get("pool") or choose_pool(readonly)
+        target.outstanding += 1
+    if readonly:
+        _pin(target)
+    try:
+        with stage("pool_wait"):
+            try:
+                conn = target.getconn()
+            except psycopg2.OperationalError as e:
+                if target is DB_POOL:
+                    raise
+                # Unreachable replica: take it out of rotation until the next lag check.
+                logger.warning(f"{target.name} unavailable, falling back to primary: {e}")
+                target.lag = float("inf")
+                with _ROUTING_LOCK:
+                    target.outstanding -= 1
+                    target = DB_POOL
+                    target.outstanding += 1
+                if readonly:
+                    _pin(target)
+                conn = target.getconn()
+        POOL_IN_USE.inc(pool=target.name)
+        try:
+            yield conn
+        finally:
+            target.putconn(conn)
+            POOL_IN_USE.dec(pool=target.name)
+    finally:
+        with _ROUTING_LOCK:
+            target.outstanding -= 1
+        ROUTED_QUERIES.inc(pool=target.name)
+
+def is_read_only(query: str) -> bool:
+    return query.lstrip().lower().startswith(("select", "with", "explain"))
+
+def run_query(query: str, typed: bool = False, budget=None):
+    # With a budget, rows come from a server-side cursor in batches (see
+    # results.fetch_rows) instead of one fetchall() of the whole result.
+    # SELECTs run in a READ ONLY transaction, even on the primary.
+    readonly = is_read_only(query)
+    with connection(readonly=readonly) as conn:
+        if readonly:
+            with conn.cursor() as cur:
+                cur.execute("SET TRANSACTION READ ONLY")
+        cur = conn.cursor(name="budgeted_result") if budget is not None else conn.cursor()
+        if typed:
+            register_fast_types(cur)
+        with stage("db_execute"):
+            cur.execute(query)
+        with stage("db_fetch"):
+            rows = fetch_rows(cur, budget) if budget is not None or cur.description else []
         columns = [desc[0] for desc in cur.description] if cur.description else []
-        rows = cur.fetchall() if cur.description else []
         cur.close()
+        if readonly:
+            conn.rollback()
         return columns, rows
-    finally:
-        DB_POOL.putconn(conn)
\ No newline at end of file
+
+def explain_cost(query: str) -> float:
+    with connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"EXPLAIN (FORMAT JSON) {query}")
+            plan = cur.fetchone()[0]
+        conn.rollback()
+        return plan[0]["Plan"]["Total Cost"]
+
+def estimated_rows(table: str):
+    # Planner's row estimate (kept current by autovacuum/ANALYZE); None if never analyzed.
+    # Partitioned tables have no estimate of their own, so their partitions' are summed.
+    with connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT CASE WHEN c.relkind = 'p' THEN (SELECT sum(p.reltuples) FILTER (WHERE p.reltuples >= 0) "
+                "FROM pg_partition_tree(c.oid) t JOIN pg_class p ON p.oid = t.relid WHERE t.isleaf) "
+                "ELSE c.reltuples END FROM pg_class c WHERE c.oid = to_regclass(%s)", (table,))
+            row = cur.fetchone()
+        conn.rollback()
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+def table_versions(tables) -> dict:
+    global _HAS_VERSION_TABLE
+    tables = sorted(tables)
+    if not tables:
+        return {}
+    if _HAS_VERSION_TABLE is not False:
+        with connection(readonly=True) as conn:
+            with conn.cursor() as cur:
+                try:
+                    cur.execute("SELECT table_name, version FROM table_versions WHERE table_name = ANY(%s)", (tables,))
+                    versions = dict(cur.fetchall())
+                    _HAS_VERSION_TABLE = True
+                except errors.UndefinedTable:
+                    _HAS_VERSION_TABLE = False
+                    logger.info("table_versions not installed; falling back to pg_stat_user_tables for ETags.")
+            conn.rollback()
+        if _HAS_VERSION_TABLE:
+            return {t: versions.get(t) for t in tables}
+    # Statistics counters lag commits slightly; install sql/table_versions.sql for exact versions.
+    # A hot standby never counts replayed writes in them, so they are read on the primary,
+    # and reads pinned by consistent_reads() follow there.
+    _pin(DB_POOL)
+    with connection() as conn:
+        with conn.cursor() as cur:
+            # Partitions' counters are summed under their partitioned table.
+            cur.execute(
+                "SELECT name, sum(n) FROM (SELECT COALESCE(pg_partition_root(relid)::text, relname) AS name, "
+                "n_tup_ins + n_tup_upd + n_tup_del AS n FROM pg_stat_user_tables) s "
+                "WHERE name = ANY(%s) GROUP BY name",
+                (tables,))
+            versions = dict(cur.fetchall())
+        conn.rollback()
+    return {t: versions.get(t) for t in tables}
+
+def run_with_watermark(query: str, table: str = "sales", column: str = "id", typed: bool = False, budget=None):
+    # The high-water mark and the query share one REPEATABLE READ snapshot, so
+    # the rows counted are exactly those with column <= watermark. Assumes the
+    # loader commits ids in increasing order.
+    with connection(readonly=True) as conn:
+        cur = conn.cursor()
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        cur.execute(f"SELECT max({column}) FROM {table}")
+        watermark = cur.fetchone()[0]
+        cur.close()
+        cur = conn.cursor(name="budgeted_result") if budget is not None else conn.cursor()
+        if typed:
+            register_fast_types(cur)
+        with stage("db_execute"):
+            cur.execute(query)
+        with stage("db_fetch"):
+            rows = fetch_rows(cur, budget) if budget is not None or cur.description else []
+        columns = [desc[0] for desc in cur.description] if cur.description else []
+        cur.close()
+        conn.rollback()
+        return columns, rows, watermark
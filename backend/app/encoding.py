@@ -0,0 +1,77 @@
+from psycopg2 import extensions
+from decimal import Decimal
+import datetime
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# NUMERIC straight to float instead of Decimal, and dates/timestamps kept as
+# the ISO text the server sent instead of building datetime objects.
+FLOAT_NUMERIC = extensions.new_type((1700,), "FLOAT_NUMERIC",
+                                    lambda value, cur: float(value) if value is not None else None)
+ISO_TEMPORAL = extensions.new_type((1082, 1114, 1184), "ISO_TEMPORAL", lambda value, cur: value)
+FLOAT_NUMERIC_ARRAY = extensions.new_array_type((1231,), "FLOAT_NUMERIC_ARRAY", FLOAT_NUMERIC)
+ISO_TEMPORAL_ARRAY = extensions.new_array_type((1182, 1115, 1185), "ISO_TEMPORAL_ARRAY", ISO_TEMPORAL)
+
+
+def register_fast_types(cursor):
+    # Cursor scope, so connections shared with untyped requests are untouched.
+    for caster in (FLOAT_NUMERIC, ISO_TEMPORAL, FLOAT_NUMERIC_ARRAY, ISO_TEMPORAL_ARRAY):
+        extensions.register_type(caster, cursor)
+
+
+_ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_ISO_TIMESTAMP = re.compile(r"^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}")
+
+
+def _value_type(value) -> str:
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, (float, Decimal)):
+        return "float"
+    if isinstance(value, (list, tuple)):
+        return "list"
+    if isinstance(value, datetime.datetime) or (isinstance(value, str) and _ISO_TIMESTAMP.match(value)):
+        return "timestamp"
+    if isinstance(value, datetime.date) or (isinstance(value, str) and _ISO_DATE.match(value)):
+        return "date"
+    return "text"
+
+
+def column_types(columns: list, rows: list) -> list:
+    # From the first non-NULL value per column, which works the same for
+    # plain, incremental and sampled results. With the fast casters dates
+    # and timestamps arrive as ISO text, recognised by shape.
+    types = []
+    for i in range(len(columns)):
+        value = next((row[i] for row in rows if row[i] is not None), None)
+        types.append(_value_type(value) if value is not None else "text")
+    return types
+
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_columnar(columns: list, types: list, rows: list) -> bytes:
+    # {"columns": [{"name", "type"}], "data": {name: [values]}, "rows": n}:
+    # one list per column is what DataFrame construction wants anyway.
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    body = {
+        "columns": [{"name": name, "type": kind} for name, kind in zip(columns, types)],
+        "data": {name: list(col) for name, col in zip(columns, values)},
+        "rows": len(rows),
+    }
+    if orjson is not None:
+        return orjson.dumps(body, default=json_default)
+    return json.dumps(body, default=json_default, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,34 @@
+import hashlib
+import json
+
+ENCODING_SUFFIXES = ("-gzip", "-br")
+
+
+def compute_etag(sql: str, versions: dict) -> str:
+    raw = json.dumps({"sql": sql, "versions": versions}, sort_keys=True, default=str)
+    return '"' + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    tag = tag.strip('"')
+    for suffix in ENCODING_SUFFIXES:
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)]
+    return tag
+
+
+def matching_tag(if_none_match: str, etag: str):
+    # Returns the client's tag that matched (kept verbatim for the 304), or None.
+    # "*" matches any current representation; the 304 then carries our own ETag.
+    if not if_none_match:
+        return None
+    target = _opaque(etag)
+    for tag in if_none_match.split(","):
+        if tag.strip() == "*":
+            return etag
+        if _opaque(tag) == target:
+            return tag.strip()
+    return None
@@ -0,0 +1,234 @@
+from app.sqltools import mask_nested, select_items, split_top_level, top_level_clause
+from app.shared_cache import TieredCache
+from app import shared_cache
+from collections import OrderedDict, namedtuple
+import threading
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+INCREMENTAL_CACHE = None
+
+# Only the sales fact table is append-only with a monotonic id.
+FACT_TABLE = "sales"
+WATERMARK_COLUMN = "id"
+
+AGGREGATE_CALL = re.compile(r"\b(sum|count|avg|min|max|array_agg|string_agg|json_agg|jsonb_agg|bool_and|bool_or|"
+                             r"every|stddev\w*|variance|var_\w+|percentile_\w+|mode|bit_and|bit_or)\s*\(", re.I)
+MERGEABLE = re.compile(r"^\s*(?:coalesce\s*\(\s*)?(sum|count|min|max|array_agg)\s*\(\s*(distinct\s+)?(.*?)\)"
+                        r"(?:\s*,\s*[^,()]+\s*\))?\s*(?:(?:as\s+)?\"?\w+\"?)?\s*$", re.I | re.S)
+_UNSUPPORTED = re.compile(r"\b(limit|offset|having|union|intersect|except|fetch\s+first|window)\b", re.I)
+FACT_REF = re.compile(rf"\b(from|join)\s+{FACT_TABLE}\b(?!\s*\()", re.I)
+RefreshResult = namedtuple("RefreshResult", "mode columns rows changed watermark key_columns")
+_ALIAS_STOP = {"on", "where", "group", "order", "join", "left", "right", "inner", "full", "cross",
+               "natural", "using", "limit", "having", "union", "window"}
+
+
+class IncrementalPlan:
+    def __init__(self, kinds, order_by):
+        # kinds[i] is "key" or the merge rule for output column i.
+        self.kinds = kinds
+        self.order_by = order_by
+        self.append_only = all(k == "key" for k in kinds)
+
+
+def plan_query(sql: str):
+    # Returns an IncrementalPlan when every output column is a group key or a
+    # SUM/COUNT/MIN/MAX/ARRAY_AGG of rows that can be merged from a delta,
+    # otherwise None (and the caller falls back to a full refresh).
+    masked = mask_nested(sql)
+    if re.match(r"\s*with\b", masked, re.I) or _UNSUPPORTED.search(masked) or re.search(r"\bover\s*\(", sql, re.I):
+        return None
+    # The delta replaces the one sales reference, which must be in the top-level
+    # FROM/JOIN: inside a subquery (e.g. a semi-join) new rows don't map to new output rows.
+    if len(FACT_REF.findall(sql)) != 1 or not FACT_REF.search(masked):
+        return None
+    items = select_items(sql)
+    if not items or any(item.endswith("*") for item in items):
+        return None
+    outer_join = re.search(r"\b(left|right|full)\s+(outer\s+)?join\b", masked, re.I)
+
+    kinds = []
+    for item in items:
+        match = MERGEABLE.match(item)
+        if match and not AGGREGATE_CALL.search(match.group(3)):
+            func, distinct, arg = match.group(1).lower(), bool(match.group(2)), match.group(3).strip()
+            if distinct and func != "array_agg":
+                return None
+            if func == "count" and arg == "*" and outer_join:
+                # Outer joins add a NULL row for unmatched groups that COUNT(*) would count.
+                return None
+            kinds.append("array_union" if distinct else ("array_concat" if func == "array_agg" else func))
+        elif AGGREGATE_CALL.search(item):
+            return None
+        else:
+            kinds.append("key")
+
+    grouped = top_level_clause(sql, r"group\s+by", ("order",)) is not None
+    if not grouped and "key" in kinds and any(k != "key" for k in kinds):
+        return None
+    if grouped and all(k == "key" for k in kinds):
+        # Appending a delta's groups would repeat those already present.
+        return None
+    order_clause = top_level_clause(sql, r"order\s+by")
+    order_by = []
+    if order_clause:
+        for part in split_top_level(order_clause):
+            term = re.match(r"^\"?(\w+)\"?(?:\s+(asc|desc))?(?:\s+nulls\s+(?:first|last))?$", part, re.I)
+            if not term:
+                return None
+            order_by.append((term.group(1), (term.group(2) or "asc").lower() == "desc"))
+    return IncrementalPlan(kinds, order_by)
+
+
+def fact_reference(sql: str):
+    # (match of "FROM/JOIN sales", end of its alias or of the table name, alias or None).
+    match = FACT_REF.search(sql)
+    alias = re.match(r"\s+(?:as\s+)?(\w+)", sql[match.end():], re.I)
+    if alias and alias.group(1).lower() not in _ALIAS_STOP:
+        return match, match.end() + alias.end(), alias.group(1)
+    return match, match.end(), None
+
+
+def delta_sql(sql: str, watermark) -> str:
+    # Swap the fact table for the rows above the watermark, keeping the alias
+    # the rest of the statement refers to.
+    match, end, alias = fact_reference(sql)
+    subquery = f"(SELECT * FROM {FACT_TABLE} WHERE {WATERMARK_COLUMN} > {int(watermark)})"
+    return f"{sql[:match.start()]}{match.group(1)} {subquery} {alias or FACT_TABLE}{sql[end:]}"
+
+
+def _merge_value(kind, old, new):
+    if new is None:
+        return old
+    if old is None:
+        return new
+    if kind in ("sum", "count"):
+        return old + new
+    if kind == "min":
+        return min(old, new)
+    if kind == "max":
+        return max(old, new)
+    merged = list(old) + [v for v in new if kind == "array_concat" or v not in old]
+    # Outer joins yield [NULL] for groups without rows; drop it once real values arrive.
+    return [v for v in merged if v is not None] or merged
+
+
+class _State:
+    def __init__(self, plan, columns, rows, watermark, versions):
+        self.plan = plan
+        self.columns = columns
+        self.watermark = watermark
+        self.versions = versions
+        self.lock = threading.Lock()
+        self.key_index = [i for i, k in enumerate(plan.kinds) if k == "key"]
+        self.rows = OrderedDict()
+        self.appended = []
+        if plan.append_only:
+            self.appended = list(rows)
+        else:
+            for row in rows:
+                self.rows[self._key(row)] = list(row)
+
+    def to_dict(self) -> dict:
+        # Shared with other workers through the tiered cache; the lock stays behind.
+        return {"kinds": self.plan.kinds, "order_by": self.plan.order_by, "columns": self.columns,
+                "rows": self.appended if self.plan.append_only else list(self.rows.values()),
+                "watermark": self.watermark, "versions": self.versions}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        plan = IncrementalPlan(data["kinds"], [tuple(term) for term in data["order_by"]])
+        return cls(plan, data["columns"], data["rows"], data["watermark"], data["versions"])
+
+    def _key(self, row):
+        return tuple(row[i] for i in self.key_index)
+
+    def merge(self, delta_rows):
+        # Returns the rows whose values changed (or were appended).
+        if self.plan.append_only:
+            self.appended.extend(delta_rows)
+            return [list(row) for row in delta_rows]
+        changed = []
+        for row in delta_rows:
+            key = self._key(row)
+            current = self.rows.get(key)
+            if current is None:
+                self.rows[key] = list(row)
+                changed.append(list(row))
+                continue
+            before = list(current)
+            for i, kind in enumerate(self.plan.kinds):
+                if kind != "key":
+                    current[i] = _merge_value(kind, current[i], row[i])
+            if current != before:
+                changed.append(list(current))
+        return changed
+
+    def result(self):
+        # Copies: callers use them after the lock is released, while merge() keeps mutating the cached rows.
+        rows = self.appended if self.plan.append_only else self.rows.values()
+        return sort_rows([list(row) for row in rows], self.columns, self.plan.order_by)
+
+
+def sort_rows(rows, columns, order_by):
+    for name, descending in reversed(order_by):
+        index = int(name) - 1 if name.isdigit() else columns.index(name)
+        nulls = [r for r in rows if r[index] is None]
+        rest = sorted((r for r in rows if r[index] is not None), key=lambda r: r[index], reverse=descending)
+        # Postgres puts NULLs last ascending and first descending.
+        rows = nulls + rest if descending else rest + nulls
+    return rows
+
+
+def init_incremental_cache(config: dict):
+    global INCREMENTAL_CACHE
+    # Cached aggregate results keyed by SQL, each with the fact-table high-water
+    # mark it reflects and the versions of the other tables it read. With a
+    # shared store, a state computed by one worker seeds the others.
+    if config.get("INCREMENTAL_ENABLED", True):
+        INCREMENTAL_CACHE = TieredCache("incremental", int(config.get("INCREMENTAL_CACHE_MAX_ENTRIES", 200)),
+                                        shared_cache.SHARED_STORE,
+                                        encode=lambda state: shared_cache.dumps(state.to_dict()),
+                                        decode=lambda blob: _State.from_dict(shared_cache.loads(blob)))
+
+
+def forget(key):
+    if INCREMENTAL_CACHE is not None:
+        INCREMENTAL_CACHE.drop(key)
+
+def refresh(sql: str, versions: dict, run_with_watermark, key=None) -> RefreshResult:
+    # mode is "full" (cached now), "merged" (delta applied to the cache) or
+    # "unsupported" (not mergeable, plain full query). run_with_watermark(sql)
+    # must run the statement and read max(id) in one snapshot. key defaults
+    # to sql; results fetched with different typecasters need their own.
+    key = key if key is not None else sql
+    plan = plan_query(sql) if INCREMENTAL_CACHE is not None else None
+    if plan is None:
+        columns, rows, watermark = run_with_watermark(sql)
+        return RefreshResult("unsupported", columns, rows, rows, watermark, [])
+
+    other_versions = {t: v for t, v in versions.items() if t != FACT_TABLE}
+    state = INCREMENTAL_CACHE.get(key)
+    if state is not None and state.versions == other_versions:
+        keys = [state.columns[i] for i in state.key_index]
+        with state.lock:
+            _, delta_rows, watermark = run_with_watermark(delta_sql(sql, state.watermark))
+            if watermark is None or watermark <= state.watermark:
+                return RefreshResult("merged", state.columns, state.result(), [], state.watermark, keys)
+            changed = state.merge(delta_rows)
+            state.watermark = watermark
+            INCREMENTAL_CACHE.put(key, state)
+            logger.info(f"Merged {len(delta_rows)} delta rows above watermark {watermark} into cached aggregate.")
+            return RefreshResult("merged", state.columns, state.result(), changed, watermark, keys)
+
+    columns, rows, watermark = run_with_watermark(sql)
+    if len(columns) != len(plan.kinds) or any(not name.isdigit() and name not in columns for name, _ in plan.order_by):
+        return RefreshResult("unsupported", columns, rows, rows, watermark, [])
+    state = _State(plan, columns, rows, watermark or 0, other_versions)
+    if not plan.append_only and len(state.rows) != len(rows):
+        # Output columns don't identify a group (GROUP BY has hidden keys).
+        INCREMENTAL_CACHE.drop(key)
+        return RefreshResult("unsupported", columns, rows, rows, watermark, [])
+    INCREMENTAL_CACHE.put(key, state)
+    return RefreshResult("full", columns, rows, rows, watermark, [columns[i] for i in state.key_index])
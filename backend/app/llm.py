@@ -1,7 +1,23 @@
+from app.providers import create_provider
 import requests
 import logging
+import re
 
 logger = logging.getLogger(__name__)
+LLM_PROVIDER = None
+_PANEL_BLOCK = re.compile(r"```sql\s*--\s*panel:\s*([\w-]+)\s*\n(.*?)```", re.S | re.I)
+
+def init_llm_provider(config: dict):
+    global LLM_PROVIDER
+    LLM_PROVIDER = create_provider(config)
+    logger.info(f"LLM provider created: {type(LLM_PROVIDER).__name__}")
+
+def close_llm_provider():
+    global LLM_PROVIDER
+    if LLM_PROVIDER:
+        LLM_PROVIDER.close()
+        LLM_PROVIDER = None
+        logger.info("LLM provider closed.")
 
 def extract_sql_query(llm_response: str) -> str:
     if not llm_response:
@@ -13,29 +29,37 @@ def extract_sql_query(llm_response: str) -> str:
             return llm_response[start+6:end].strip()
     return llm_response.strip()
 
-def generate_sql_query(prompt: str, schema_context: str, api_key: str) -> str:
-    data = {
-        "model": "gpt-4",
-        "messages": [
-            {"role": "system", "content": f"You are a helpful assistant... {schema_context}"},
-            {"role": "user", "content": f"Generate a single SQL query for this request: {prompt}"}
-        ],
-        "temperature": 0,
-        "n": 1,
-        "max_tokens": 500,
-    }
-
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+def generate_sql_query(prompt: str, schema_context: str) -> str:
+    messages = [
+        {"role": "system", "content": f"You are a helpful assistant... {schema_context}"},
+        {"role": "user", "content": f"Generate a single SQL query for this request: {prompt}"}
+    ]
+
+    try:
+        content = LLM_PROVIDER.complete(messages, max_tokens=500)
+    except requests.RequestException as e:
+        logger.error(f"LLM request failed: {e}")
+        raise
+
+    return extract_sql_query(content)
+
+def generate_sql_batch(prompts: dict, schema_context: str) -> dict:
+    # One LLM round trip for every panel; each answer is a ```sql block whose
+    # first line is "-- panel: <name>". Panels the model skipped are missing
+    # from the result and left to the caller.
+    panel_lines = "\n".join(f"panel {name}: {prompt}" for name, prompt in prompts.items())
+    messages = [
+        {"role": "system", "content": f"You are a helpful assistant... {schema_context}"},
+        {"role": "user", "content": (
+            "Generate one single SQL query per panel below. Answer with one ```sql block per panel "
+            "whose first line is `-- panel: <name>`.\n" + panel_lines
+        )}
+    ]
 
     try:
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=data)
-        response.raise_for_status()
+        content = LLM_PROVIDER.complete(messages, max_tokens=500 * len(prompts))
     except requests.RequestException as e:
-        logger.error(f"OpenAI API request failed: {e}")
+        logger.error(f"LLM request failed: {e}")
         raise
 
-    body = response.json()
-    return extract_sql_query(body["choices"][0]["message"]["content"])
+    return {name: sql.strip() for name, sql in _PANEL_BLOCK.findall(content) if name in prompts}
@@ -0,0 +1,184 @@
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from collections import deque
+from email.utils import parsedate_to_datetime
+import threading
+import random
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+OPENAI_URL = "https://api.openai.com/v1/chat/completions"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LLMClient:
+    def __init__(self, api_key: str, url: str = OPENAI_URL, pool_size: int = 10,
+                 connect_timeout: float = 3.05, read_timeout: float = 60.0,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 20.0,
+                 max_concurrency: int = 4, hedge: bool = False, hedge_min_samples: int = 20,
+                 hedge_budget: float = 0.1):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_budget = hedge_budget
+
+        # One keep-alive pool shared by every request thread.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+        self._limiter = threading.BoundedSemaphore(max_concurrency)
+        self._latencies = deque(maxlen=200)
+        self._latency_lock = threading.Lock()
+        # Whether each recent request fired a hedge, for the hedge budget.
+        self._hedged = deque(maxlen=200)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2,
+                                            thread_name_prefix="llm-hedge") if hedge else None
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(
+            api_key=config.get("OPENAI_API_KEY", ""),
+            url=config.get("LLM_API_URL", OPENAI_URL),
+            pool_size=int(config.get("LLM_POOL_SIZE", 10)),
+            connect_timeout=float(config.get("LLM_CONNECT_TIMEOUT", 3.05)),
+            read_timeout=float(config.get("LLM_READ_TIMEOUT", 60)),
+            max_retries=int(config.get("LLM_MAX_RETRIES", 3)),
+            backoff_base=float(config.get("LLM_BACKOFF_BASE", 0.5)),
+            backoff_max=float(config.get("LLM_BACKOFF_MAX", 20)),
+            max_concurrency=int(config.get("LLM_MAX_CONCURRENCY", 4)),
+            hedge=bool(config.get("LLM_HEDGE", False)),
+            hedge_budget=float(config.get("LLM_HEDGE_BUDGET", 0.1)),
+        )
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def post(self, payload: dict) -> dict:
+        attempt = 0
+        while True:
+            try:
+                hedge_delay = self._hedge_delay()
+                response = self._send_hedged(payload, hedge_delay) if hedge_delay else self._send(payload)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"LLM request failed ({e}); retrying in {delay:.2f}s")
+            else:
+                if response.ok:
+                    return response.json()
+                # Hedged responses are streamed; closing returns their connection to the pool.
+                response.close()
+                delay = self._retry_after(response)
+                if delay is not None and delay > self.backoff_max:
+                    # Asked to wait longer than we would ever back off: fail now instead.
+                    logger.warning(f"LLM request returned {response.status_code} with Retry-After {delay:.0f}s; "
+                                   f"giving up")
+                    response.raise_for_status()
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    response.raise_for_status()
+                if delay is None:
+                    delay = self._backoff(attempt)
+                logger.warning(f"LLM request returned {response.status_code}; retrying in {delay:.2f}s")
+            attempt += 1
+            time.sleep(delay)
+
+    def _send(self, payload: dict, blocking: bool = True, stream: bool = False):
+        if not self._limiter.acquire(blocking=blocking):
+            return None
+        try:
+            start = time.perf_counter()
+            response = self.session.post(self.url, json=payload, timeout=self.timeout, stream=stream)
+            if response.ok:
+                with self._latency_lock:
+                    self._latencies.append(time.perf_counter() - start)
+            return response
+        finally:
+            self._limiter.release()
+
+    def _send_hedged(self, payload: dict, delay: float):
+        # Fire a duplicate once the first attempt is slower than the observed p95,
+        # but only if the limiter has a spare slot and the hedge budget allows;
+        # the first response wins and the other one is discarded.
+        # Streamed, so a discarded response is closed without downloading its body.
+        primary = self._executor.submit(self._send, payload, True, True)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._may_hedge():
+            self._record_hedge(False)
+            return primary.result()
+        self._record_hedge(True)
+        hedge = self._executor.submit(self._send, payload, False, True)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result() is not None:
+                    if future is hedge:
+                        logger.info("Hedged LLM request won.")
+                    for loser in pending:
+                        self._discard(loser)
+                    return future.result()
+        return primary.result()
+
+    def _discard(self, future):
+        # A request still queued for a worker never starts; one already in flight
+        # holds its limiter slot until the headers arrive, then its connection is
+        # closed rather than reading a body nobody wants.
+        if not future.cancel():
+            future.add_done_callback(_close_response)
+
+    def _may_hedge(self) -> bool:
+        # When the upstream slows down as a whole every request crosses the p95;
+        # the budget keeps duplicates to a fraction of traffic instead of doubling it.
+        with self._latency_lock:
+            return sum(self._hedged) < self.hedge_budget * max(len(self._hedged), 1)
+
+    def _record_hedge(self, hedged: bool):
+        with self._latency_lock:
+            self._hedged.append(hedged)
+
+    def _hedge_delay(self):
+        if not self.hedge:
+            return None
+        with self._latency_lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform in [0, min(cap, base * 2^attempt)].
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _retry_after(self, response):
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                seconds = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return max(seconds, 0.0)
+
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None and future.result() is not None:
+        future.result().close()
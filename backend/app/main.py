@@ -1,11 +1,37 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from app.utils import load_all_schema_contexts, QueryRequest
-from app.database import init_db_pool, close_db_pool, run_query
-from app.llm import generate_sql_query
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, FileResponse
+from fastapi.encoders import jsonable_encoder
+from app.utils import load_all_schema_contexts, load_schema_columns, load_config, QueryRequest, BatchRequest
+from app.database import (init_db_pool, close_db_pool, run_query, run_with_watermark, explain_cost, table_versions,
+                          estimated_rows, consistent_reads)
+from app.llm import init_llm_provider, close_llm_provider, generate_sql_query, generate_sql_batch
+from app.compression import CompressionMiddleware
+from app.etag import compute_etag, matching_tag
+from app.sqltools import referenced_tables, is_single_select
+from app.incremental import init_incremental_cache, refresh
+from app.approximate import init_approximate, approximate
+from app.semantic_cache import init_sql_cache, cached_sql, remember_sql
+from app.templates import init_templates, template_sql
+from app.encoding import column_types, encode_columnar
+from app.results import init_result_limits, new_budget, spilled_path
+from app.incremental import forget as forget_incremental
+from app.querylog import init_query_log, close_query_log, log_query
+from app.warmup import init_warmup, close_warmup, is_ready
+from app.shared_cache import init_shared_cache, cached_result, remember_result
+from app.scheduler import init_scheduler, tenant_of, scheduled, llm_tokens, QuotaExceeded
+from app import notifications
+from app import metrics
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
 from pathlib import Path
+import contextvars
+import asyncio
 import logging
-import json
+import time
+import re
+import os
 
 app = FastAPI()
 logging.basicConfig(level=logging.INFO)
@@ -16,40 +42,373 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "ETag", "X-Refresh-Mode", "X-Watermark", "X-Group-Key", "X-Tables",
+                    "X-Approximate", "X-Sample-Percent", "X-Result-Overflow"],
 )
 
-CONFIG_PATH = Path(__file__).parent.parent / "config.json"
+CONFIG_PATH = Path(os.environ.get("APP_CONFIG", Path(__file__).parent.parent / "config.json"))
 try:
-    with open(CONFIG_PATH) as f:
-        config = json.load(f)
+    config = load_config(CONFIG_PATH)
     logger.info("Loaded config.json")
 except Exception as e:
     logger.error(f"Failed to load config.json: {e}")
     raise
 
+app.add_middleware(CompressionMiddleware, minimum_size=int(config.get("COMPRESSION_MIN_BYTES", 1024)))
+SCHEMA_COLUMNS = load_schema_columns()
+TABLE_NAMES = set(SCHEMA_COLUMNS)
+PANEL_NAME = re.compile(r"^[\w-]+$")
+BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=int(config.get("DB_POOL_MAX", 10)), thread_name_prefix="batch")
+
 @app.on_event("startup")
 def startup():
     init_db_pool(config)
+    init_llm_provider(config)
+    init_query_log(config, explain=explain_cost)
+    init_shared_cache(config)
+    init_scheduler(config)
+    init_sql_cache(config, SCHEMA_COLUMNS)
+    init_templates(config)
+    init_incremental_cache(config)
+    init_approximate(config)
+    init_result_limits(config)
+    notifications.init_change_listener(config)
+    init_warmup(config, warm_prompt, lambda: table_versions(TABLE_NAMES))
 
 @app.on_event("shutdown")
 def shutdown():
+    close_warmup()
+    BATCH_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    notifications.close_change_listener()
+    close_query_log()
     close_db_pool()
+    close_llm_provider()
+
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    token = metrics.begin_request()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        timings = metrics.end_request(token)
+        elapsed = time.perf_counter() - start
+        # Label by route template so unknown URLs can't blow up cardinality.
+        route = request.scope.get("route")
+        path = route.path if route else "unmatched"
+        metrics.REQUESTS.inc(path=path, status=status)
+        metrics.REQUEST_SECONDS.observe(elapsed, path=path)
+    if timings:
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings + [("total", elapsed)])
+    return response
+
+@app.exception_handler(QuotaExceeded)
+def quota_exceeded_handler(request: Request, exc: QuotaExceeded):
+    return JSONResponse({"detail": str(exc)}, status_code=exc.status, headers={"Retry-After": str(exc.retry_after)})
+
+@app.get("/api/ready")
+def ready_handler():
+    # For load balancer readiness probes: 503 until startup warm-up has finished.
+    if not is_ready():
+        return JSONResponse({"ready": False}, status_code=503)
+    return {"ready": True}
+
+@app.get("/metrics")
+def metrics_handler():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def resolve_sql(prompt: str, tenant: str):
+    # Templates first (no I/O at all), then SQL reused for a similar prompt, then the LLM.
+    with metrics.stage("template"):
+        sql_query = template_sql(prompt)
+    if sql_query is not None:
+        return sql_query, "template"
+    with metrics.stage("sql_cache"):
+        sql_query = cached_sql(prompt)
+    metrics.cache_lookup("sql", sql_query is not None)
+    if sql_query is not None:
+        return sql_query, "cache"
+    with metrics.stage("schema"):
+        schema_context = load_all_schema_contexts()
+    with scheduled("llm", tenant, tokens=llm_tokens(prompt, schema_context)), metrics.stage("llm"):
+        return generate_sql_query(prompt, schema_context), "llm"
+
+def warm_prompt(prompt: str):
+    # What the dashboard sends (incremental, typed), minus the response, so the
+    # SQL cache, the incremental result cache and Postgres' buffers are warm.
+    # Queued as its own tenant, so a scheduled re-warm can't crowd out users.
+    sql_query, source = resolve_sql(prompt, "warmup")
+    if not is_single_select(sql_query):
+        raise ValueError("Only a single SELECT statement is allowed.")
+    key = (sql_query, True)
+    budget = new_budget("truncate")
+    try:
+        with consistent_reads(), scheduled("db", "warmup"):
+            versions = table_versions(referenced_tables(sql_query, TABLE_NAMES))
+            refresh(sql_query, versions, partial(run_with_watermark, typed=True, budget=budget), key=key)
+        if budget is not None and budget.truncated:
+            forget_incremental(key)
+    finally:
+        if budget is not None:
+            budget.release()
+    if source == "llm":
+        remember_sql(prompt, sql_query)
+
+def execute_query(request: QueryRequest, sql_query: str, versions: dict, budget, headers: dict):
+    # Runs the statement in the requested mode, adding that mode's response headers.
+    if request.approximate:
+        mode, columns, rows, percent = approximate(
+            sql_query, partial(run_query, typed=request.typed, budget=budget), estimated_rows)
+        headers["X-Approximate"] = mode
+        headers["X-Sample-Percent"] = f"{percent:.6g}"
+    elif request.incremental or request.delta:
+        key = (sql_query, request.typed)
+        result = refresh(sql_query, versions, partial(run_with_watermark, typed=request.typed, budget=budget),
+                         key=key)
+        if budget is not None and budget.truncated:
+            forget_incremental(key)
+        metrics.cache_lookup("incremental", result.mode == "merged")
+        columns, rows = result.columns, result.rows
+        if request.delta and result.mode == "merged":
+            # Only groups whose values moved, already merged; clients upsert by X-Group-Key.
+            rows = result.changed
+        headers["X-Refresh-Mode"] = result.mode
+        headers["X-Watermark"] = str(result.watermark)
+        headers["X-Group-Key"] = ",".join(result.key_columns)
+    else:
+        columns, rows = run_query(sql_query, typed=request.typed, budget=budget)
+    return columns, rows
 
 @app.post("/api/query")
-def query_handler(request: QueryRequest):
+def query_handler(request: QueryRequest, http_request: Request):
     user_prompt = request.query
-    logger.info(f"Received query: {user_prompt}")
+    tenant = tenant_of(http_request)
+    logger.info(f"Received query from {tenant}: {user_prompt}")
+
+    sql_query, source = resolve_sql(user_prompt, tenant)
+    from_cache = source != "llm"
+    logger.info(f"{'Generated' if source == 'llm' else source.title()} SQL: {sql_query}")
+
+    if not is_single_select(sql_query):
+        log_query(user_prompt, sql_query, stages=metrics.current_stages(), error="rejected: not a single SELECT")
+        raise HTTPException(status_code=400, detail="Only a single SELECT statement is allowed.")
 
-    schema_context = load_all_schema_contexts()
-    sql_query = generate_sql_query(user_prompt, schema_context, config["OPENAI_API_KEY"])
-    logger.info(f"Generated SQL: {sql_query}")
+    # Versions and data come from one server, so an ETag never labels older rows.
+    with consistent_reads():
+        budget = None
+        try:
+            with metrics.stage("etag"):
+                versions = table_versions(referenced_tables(sql_query, TABLE_NAMES))
+                variant = " -- approximate" if request.approximate else (" -- delta" if request.delta else "")
+                variant += " -- typed" if request.typed else ""
+                etag = compute_etag(sql_query + variant, versions)
+            matched = matching_tag(http_request.headers.get("if-none-match"), etag)
+            if matched:
+                metrics.cache_lookup("etag", True)
+                if not from_cache:
+                    remember_sql(user_prompt, sql_query)
+                log_query(user_prompt, sql_query, stages=metrics.current_stages(), not_modified=True)
+                return Response(status_code=304, headers={"ETag": matched, "Cache-Control": "no-cache",
+                                                          "X-Tables": ",".join(versions)})
+            metrics.cache_lookup("etag", False)
 
-    if not sql_query.lower().startswith("select"):
-        raise HTTPException(status_code=400, detail="Only SELECT statements are allowed.")
+            # The same result computed by any worker, unless the client needs its own delta.
+            result_key = etag + (" -- incremental" if request.incremental else "")
+            with metrics.stage("result_cache"):
+                cached = cached_result(result_key) if not request.delta else None
+            if not request.delta:
+                metrics.cache_lookup("result", cached is not None)
+            if cached is not None:
+                body, media_type, cached_headers = cached
+                if not from_cache:
+                    remember_sql(user_prompt, sql_query)
+                log_query(user_prompt, sql_query, size=len(body), stages=metrics.current_stages(), source=source,
+                          result_cache=True)
+                return Response(body, media_type=media_type, headers=cached_headers)
 
+            # Tells live clients which change events should refresh this result.
+            headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Tables": ",".join(versions)}
+            # Sampled and incremental rows are post-processed here, so those modes truncate rather than spill.
+            budget = new_budget("truncate" if request.approximate or request.incremental or request.delta else None)
+            with scheduled("db", tenant):
+                columns, rows = execute_query(request, sql_query, versions, budget, headers)
+            if budget is not None and budget.overflowed:
+                # Partial or by-reference results must not be revalidated later.
+                del headers["ETag"]
+                headers["X-Result-Overflow"] = "spilled" if budget.spill else "truncated"
+            with metrics.stage("encode"):
+                if budget is not None and budget.spill:
+                    response = JSONResponse(budget.spill.describe(), headers=headers)
+                elif request.typed:
+                    body = encode_columnar(columns, column_types(columns, rows), rows)
+                    response = Response(body, media_type="application/json", headers=headers)
+                else:
+                    response = JSONResponse(jsonable_encoder([dict(zip(columns, row)) for row in rows]), headers=headers)
+            if not request.delta and "ETag" in headers:
+                remember_result(result_key, response.body, response.media_type, headers)
+        except QuotaExceeded:
+            raise
+        except Exception as e:
+            logger.exception("Query execution failed.")
+            log_query(user_prompt, sql_query, stages=metrics.current_stages(), error=str(e))
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            if budget is not None:
+                budget.release()
+
+    if not from_cache:
+        remember_sql(user_prompt, sql_query)
+    log_query(user_prompt, sql_query, rows=budget.spill.rows if budget and budget.spill else len(rows),
+              size=len(response.body), stages=metrics.current_stages(), source=source)
+    return response
+
+@app.get("/api/results/{result_id}")
+def result_handler(result_id: str):
+    # Results that overflowed their memory budget, written to disk by /api/query or /api/batch.
+    path = spilled_path(result_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Result not found or expired.")
+    media_type = "application/vnd.apache.parquet" if path.suffix == ".parquet" else "application/x-ndjson"
+    return FileResponse(path, media_type=media_type, filename=path.name)
+
+@app.websocket("/ws/changes")
+async def changes_socket(websocket: WebSocket):
+    # Pushes {"type": "changes", "tables": {table: version}} after loaders
+    # commit; clients re-run the queries that read those tables.
+    listener = notifications.CHANGE_LISTENER
+    await websocket.accept()
+    if listener is None:
+        await websocket.close(code=1013, reason="Change notifications are disabled.")
+        return
+    subscriber = listener.subscribe(asyncio.get_running_loop())
+    receiver = asyncio.ensure_future(websocket.receive_text())
+    try:
+        while True:
+            batch = asyncio.ensure_future(subscriber.next_batch())
+            done, _ = await asyncio.wait({batch, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if batch in done:
+                await websocket.send_json({"type": "changes", "tables": batch.result()})
+            else:
+                batch.cancel()
+            if receiver in done:
+                # Clients don't send anything meaningful; this is how a close arrives.
+                receiver.result()
+                receiver = asyncio.ensure_future(websocket.receive_text())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        listener.unsubscribe(subscriber)
+
+def panel_error(name: str, prompt: str, sql_query: str):
+    # The result for a panel that can't run, or None.
+    if not sql_query:
+        return {"error": "No SQL was generated for this panel."}
+    if not is_single_select(sql_query):
+        log_query(prompt, sql_query, error="rejected: not a single SELECT", panel=name, elapsed=0.0)
+        return {"sql": sql_query, "error": "Only a single SELECT statement is allowed."}
+    return None
+
+def run_panel(name: str, prompt: str, sql_query: str, slot: ExitStack) -> dict:
+    # slot holds the database slot taken for this panel before it was submitted; released here.
+    # Panels run side by side, so each logs its own elapsed time rather than the whole batch's.
+    start = time.perf_counter()
+    budget = new_budget()
     try:
-        columns, rows = run_query(sql_query)
-        return [dict(zip(columns, row)) for row in rows]
+        with slot:
+            columns, rows = run_query(sql_query, budget=budget)
     except Exception as e:
-        logger.exception("Query execution failed.")
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+        logger.exception(f"Panel {name} failed.")
+        log_query(prompt, sql_query, error=str(e), panel=name, elapsed=time.perf_counter() - start)
+        return {"sql": sql_query, "error": str(e)}
+    finally:
+        if budget is not None:
+            budget.release()
+    if prompt:
+        remember_sql(prompt, sql_query)
+    if budget is not None and budget.spill:
+        log_query(prompt, sql_query, rows=budget.spill.rows, panel=name, spilled=True,
+                  elapsed=time.perf_counter() - start)
+        return {"sql": sql_query, **budget.spill.describe()}
+    log_query(prompt, sql_query, rows=len(rows), panel=name, elapsed=time.perf_counter() - start)
+    result = {"sql": sql_query, "columns": columns, "rows": [dict(zip(columns, row)) for row in rows]}
+    if budget is not None and budget.truncated:
+        result["truncated"] = True
+    return result
+
+def resolve_missing(prompt: str, schema_context: str, slot: ExitStack) -> str:
+    with slot, metrics.stage("llm"):
+        return generate_sql_query(prompt, schema_context)
+
+def take_slot(resource: str, tenant: str, tokens: float = 0) -> ExitStack:
+    # Waits for the tenant's fair-queued slot here, before the work is handed to
+    # BATCH_EXECUTOR, so only tasks that hold a slot occupy its threads and one
+    # tenant's large batch can't keep everyone else's panels waiting in its queue.
+    stack = ExitStack()
+    stack.enter_context(scheduled(resource, tenant, tokens=tokens))
+    return stack
+
+@app.post("/api/batch")
+def batch_handler(request: BatchRequest, http_request: Request):
+    if not request.panels:
+        raise HTTPException(status_code=400, detail="At least one panel is required.")
+    for name, panel in request.panels.items():
+        if not PANEL_NAME.match(name):
+            raise HTTPException(status_code=400, detail=f"Invalid panel name: {name}")
+        if bool(panel.query) == bool(panel.sql):
+            raise HTTPException(status_code=400, detail=f"Panel {name} needs exactly one of query or sql.")
+    tenant = tenant_of(http_request)
+    logger.info(f"Received batch from {tenant}: {list(request.panels)}")
+
+    sql_by_panel = {name: panel.sql.strip() for name, panel in request.panels.items() if panel.sql}
+    prompts = {name: panel.query for name, panel in request.panels.items() if panel.query}
+    with metrics.stage("template"):
+        for name, prompt in prompts.items():
+            sql = template_sql(prompt)
+            if sql is not None:
+                sql_by_panel[name] = sql
+    with metrics.stage("sql_cache"):
+        for name, prompt in prompts.items():
+            if name in sql_by_panel:
+                continue
+            sql = cached_sql(prompt)
+            metrics.cache_lookup("sql", sql is not None)
+            if sql is not None:
+                sql_by_panel[name] = sql
+    to_generate = {name: prompt for name, prompt in prompts.items() if name not in sql_by_panel}
+    if to_generate:
+        with metrics.stage("schema"):
+            schema_context = load_all_schema_contexts()
+        tokens = llm_tokens(schema_context, *to_generate.values(), max_tokens=500 * len(to_generate))
+        with scheduled("llm", tenant, tokens=tokens), metrics.stage("llm"):
+            generated = generate_sql_batch(to_generate, schema_context)
+        # Anything the model left out of the combined answer gets its own call.
+        missing = [name for name in to_generate if name not in generated]
+        calls = [BATCH_EXECUTOR.submit(contextvars.copy_context().run, resolve_missing, prompts[name], schema_context,
+                                       take_slot("llm", tenant, llm_tokens(prompts[name], schema_context)))
+                 for name in missing]
+        for name, call in zip(missing, calls):
+            generated[name] = call.result()
+        sql_by_panel.update(generated)
+
+    # Each task runs in a copy of this request's context so its stage timings
+    # land in the same Server-Timing header.
+    results, futures = {}, {}
+    for name in request.panels:
+        prompt, sql_query = prompts.get(name, ""), sql_by_panel.get(name, "")
+        results[name] = panel_error(name, prompt, sql_query)
+        if results[name] is not None:
+            continue
+        try:
+            slot = take_slot("db", tenant)
+        except QuotaExceeded as e:
+            results[name] = {"sql": sql_query, "error": str(e), "retry_after": e.retry_after}
+            continue
+        futures[name] = BATCH_EXECUTOR.submit(contextvars.copy_context().run, run_panel,
+                                              name, prompt, sql_query, slot)
+    for name, future in futures.items():
+        results[name] = future.result()
+    with metrics.stage("encode"):
+        return JSONResponse(jsonable_encoder({"panels": results}))
\ No newline at end of file
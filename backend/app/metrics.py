@@ -0,0 +1,184 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Per-request list of (stage, seconds) and start time, set up by the timing middleware.
+_request_timings = ContextVar("request_timings", default=None)
+_request_start = ContextVar("request_start", default=None)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict):
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_sample(self, key, state):
+        counts, total, count = state
+        lines = [f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', b)])} {c}"
+                 for b, c in zip(self.buckets, counts)]
+        lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+REGISTRY = []
+
+REQUESTS = Counter("app_requests_total", "HTTP requests handled.", ["path", "status"])
+REQUEST_SECONDS = Histogram("app_request_seconds", "End-to-end request latency.", ["path"])
+STAGE_SECONDS = Histogram("app_stage_seconds", "Time spent in each request stage.", ["stage"])
+CACHE_REQUESTS = Counter("app_cache_requests_total", "Cache lookups by outcome.", ["cache", "result"])
+POOL_IN_USE = Gauge("app_db_pool_connections_in_use", "Pool connections checked out.", ["pool"])
+POOL_MAX = Gauge("app_db_pool_connections_max", "Pool size limit.", ["pool"])
+REPLICA_LAG = Gauge("app_db_replica_lag_seconds", "Last measured replay lag (-1 when unreachable).", ["pool"])
+ROUTED_QUERIES = Counter("app_db_routed_total", "Connections checked out per pool.", ["pool"])
+TEMPLATE_MATCHES = Counter("app_template_matches_total", "Prompts answered by each SQL template.", ["template"])
+CHANGE_EVENTS = Counter("app_change_events_total", "Coalesced table change events pushed to clients.")
+CHANGE_SUBSCRIBERS = Gauge("app_change_subscribers", "Open /ws/changes connections.")
+SHARED_CACHE_EVICTIONS = Counter("app_shared_cache_evictions_total", "Entries evicted from the shared cache.")
+SCHEDULER_QUEUE_DEPTH = Gauge("app_scheduler_queue_depth", "Requests waiting for a slot, per tenant.",
+                              ["resource", "tenant"])
+SCHEDULER_WAIT_SECONDS = Histogram("app_scheduler_wait_seconds", "Time queued for a slot, per tenant.",
+                                   ["resource", "tenant"])
+SCHEDULER_REJECTIONS = Counter("app_scheduler_rejections_total", "Requests refused by quota or queue limits.",
+                               ["resource", "tenant", "reason"])
+WARMUP_PROMPTS = Counter("app_warmup_prompts_total", "Prompts replayed by cache warm-up, by outcome.", ["result"])
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+def begin_request():
+    return _request_timings.set([]), _request_start.set(time.perf_counter())
+
+
+def end_request(token):
+    timings_token, start_token = token
+    timings = _request_timings.get()
+    _request_timings.reset(timings_token)
+    _request_start.reset(start_token)
+    return timings or []
+
+
+def request_elapsed():
+    # Wall-clock seconds since the current request started; None outside one.
+    start = _request_start.get()
+    return time.perf_counter() - start if start is not None else None
+
+
+def current_stages() -> dict:
+    totals = {}
+    for name, seconds in _request_timings.get() or []:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return totals
+
+
+def record_stage(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def cache_lookup(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def server_timing_header(timings) -> str:
+    # Repeated stages (e.g. several db round trips) are summed.
+    totals = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
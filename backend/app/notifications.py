@@ -0,0 +1,227 @@
+from app.metrics import CHANGE_EVENTS, CHANGE_SUBSCRIBERS
+from pathlib import Path
+import psycopg2
+import argparse
+import asyncio
+import threading
+import select
+import logging
+import json
+import time
+
+logger = logging.getLogger(__name__)
+CHANGE_LISTENER = None
+BACKEND_DIR = Path(__file__).parent.parent
+VERSIONS_SQL = BACKEND_DIR / "sql" / "table_versions.sql"
+DEFAULT_CHANNEL = "table_changes"
+
+
+class _Subscriber:
+    # Changes not yet sent to one client. A slow client doesn't queue events:
+    # everything that arrives meanwhile merges into one pending batch.
+    def __init__(self, loop):
+        self.loop = loop
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def _add(self, tables: dict):
+        self.pending.update(tables)
+        self.ready.set()
+
+    async def next_batch(self) -> dict:
+        await self.ready.wait()
+        self.ready.clear()
+        batch, self.pending = self.pending, {}
+        return batch
+
+
+class ChangeListener:
+    # LISTENs on a dedicated connection (pooled connections can't sit idle in
+    # LISTEN) and fans table change notifications out to WebSocket clients.
+    # Bursts are coalesced: an event goes out once the channel has been quiet
+    # for `debounce` seconds, or after `max_delay` seconds at the latest.
+    def __init__(self, config: dict, channel: str = DEFAULT_CHANNEL, debounce: float = 0.25, max_delay: float = 2.0):
+        self.config = config
+        self.channel = channel
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="change-listener", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    def subscribe(self, loop) -> _Subscriber:
+        subscriber = _Subscriber(loop)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        CHANGE_SUBSCRIBERS.inc()
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+        CHANGE_SUBSCRIBERS.dec()
+
+    def publish(self, tables: dict):
+        CHANGE_EVENTS.inc()
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber._add, tables)
+            except RuntimeError:
+                # Event loop already closed; the socket is going away.
+                pass
+
+    def _connect(self):
+        conn = psycopg2.connect(
+            host=self.config.get("DB_HOST", "localhost"),
+            port=self.config.get("DB_PORT", "5432"),
+            dbname=self.config.get("DB_NAME"),
+            user=self.config.get("DB_USER"),
+            password=self.config.get("DB_PASSWORD")
+        )
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN "{self.channel}"')
+            installed = trigger_channel(cur)
+        if installed is not None and installed != self.channel:
+            logger.warning(f"The table_versions triggers notify {installed!r}, not {self.channel!r}; "
+                           f"live updates stay silent until python -m app.notifications install is run.")
+        logger.info(f"Listening for table changes on channel {self.channel}.")
+        return conn
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                conn = self._connect()
+            except psycopg2.Error as e:
+                logger.warning(f"Change listener cannot connect, retrying in {backoff:.0f}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            backoff = 1.0
+            try:
+                self._listen(conn)
+            except psycopg2.Error as e:
+                logger.warning(f"Change listener connection lost: {e}")
+            except Exception:
+                # Anything else would end the thread, and with it live updates, for good.
+                logger.exception("Change listener failed; reconnecting.")
+                self._stop.wait(backoff)
+            finally:
+                conn.close()
+
+    def _listen(self, conn):
+        pending, first_seen, last_seen = {}, None, None
+        while not self._stop.is_set():
+            if pending:
+                now = time.monotonic()
+                timeout = max(0.0, min(last_seen + self.debounce, first_seen + self.max_delay) - now)
+            else:
+                timeout = 1.0
+            if select.select([conn], [], [], timeout) != ([], [], []):
+                conn.poll()
+                now = time.monotonic()
+                while conn.notifies:
+                    payload = conn.notifies.pop(0).payload
+                    try:
+                        table, version = _parse_payload(payload)
+                    except Exception as e:
+                        logger.warning(f"Ignoring change notification {payload!r}: {e}")
+                        continue
+                    if table:
+                        pending[table] = version
+                        first_seen = first_seen or now
+                        last_seen = now
+            # Checked after every wake-up, not only on a quiet timeout: a steady
+            # stream of notifications must still be published after max_delay.
+            now = time.monotonic()
+            if pending and now >= min(last_seen + self.debounce, first_seen + self.max_delay):
+                self.publish(pending)
+                pending, first_seen, last_seen = {}, None, None
+
+
+def _parse_payload(payload: str):
+    # The table_versions trigger sends {"table": ..., "version": ...};
+    # loaders without it can simply NOTIFY table_changes, 'sales'.
+    # Anything else that parses as JSON (a number, a list) names no table.
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return payload.strip() or None, None
+    if not isinstance(data, dict) or not isinstance(data.get("table"), str):
+        return None, None
+    return data["table"], data.get("version")
+
+
+def versions_sql(channel: str = DEFAULT_CHANNEL) -> str:
+    # sql/table_versions.sql with its triggers notifying `channel`.
+    quoted = "'" + channel.replace("'", "''") + "'"
+    return VERSIONS_SQL.read_text().replace(f"bump_table_version('{DEFAULT_CHANNEL}')", f"bump_table_version({quoted})")
+
+
+def trigger_channel(cur):
+    # Channel the installed sales trigger notifies; None when it isn't installed.
+    cur.execute("SELECT t.tgargs FROM pg_trigger t WHERE t.tgname = 'sales_version' "
+                "AND t.tgrelid = to_regclass('sales')")
+    row = cur.fetchone()
+    if row is None:
+        return None
+    args = bytes(row[0]).split(b"\0")
+    return args[0].decode() if args[0] else DEFAULT_CHANNEL
+
+
+def init_change_listener(config: dict):
+    global CHANGE_LISTENER
+    if not config.get("CHANGE_NOTIFY_ENABLED", True):
+        return
+    CHANGE_LISTENER = ChangeListener(
+        config,
+        channel=config.get("CHANGE_NOTIFY_CHANNEL", DEFAULT_CHANNEL),
+        debounce=float(config.get("CHANGE_NOTIFY_DEBOUNCE_MS", 250)) / 1000,
+        max_delay=float(config.get("CHANGE_NOTIFY_MAX_DELAY_MS", 2000)) / 1000,
+    )
+    CHANGE_LISTENER.start()
+
+def close_change_listener():
+    global CHANGE_LISTENER
+    if CHANGE_LISTENER:
+        CHANGE_LISTENER.stop()
+        CHANGE_LISTENER = None
+        logger.info("Change listener stopped.")
+
+
+def main():
+    from app.utils import load_config
+
+    parser = argparse.ArgumentParser(description="Install the table_versions triggers for CHANGE_NOTIFY_CHANNEL.")
+    parser.add_argument("command", choices=["install"])
+    parser.add_argument("--config", default=str(BACKEND_DIR / "config.json"))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = load_config(args.config)
+    channel = config.get("CHANGE_NOTIFY_CHANNEL", DEFAULT_CHANNEL)
+    conn = psycopg2.connect(host=config.get("DB_HOST", "localhost"), port=config.get("DB_PORT", "5432"),
+                            dbname=config.get("DB_NAME"), user=config.get("DB_USER"),
+                            password=config.get("DB_PASSWORD"))
+    try:
+        with conn.cursor() as cur:
+            cur.execute(versions_sql(channel))
+        conn.commit()
+        logger.info(f"table_versions triggers installed, notifying {channel}.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+from datetime import date, datetime, timedelta
+from app.notifications import versions_sql, trigger_channel
+from pathlib import Path
+import argparse
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+BACKEND_DIR = Path(__file__).parent.parent
+TABLE = "sales"
+DEFAULT_PARTITION = f"{TABLE}_default"
+GRANULARITIES = ("month", "day")
+_PARTITION_NAME = re.compile(rf"^{TABLE}_p(\d{{4}})_(\d{{2}})(?:_(\d{{2}}))?$")
+
+# Same columns as bench/seed.py, with sale_date NOT NULL and part of the key
+# (Postgres requires the partition key in every unique constraint). Identity
+# columns on partitioned tables need Postgres 17, so ids come from an owned
+# sequence, which pg_get_serial_sequence() still finds.
+PARTITIONED_DDL = f"""
+CREATE SEQUENCE {TABLE}_id_seq AS BIGINT;
+CREATE TABLE {TABLE} (
+    id BIGINT NOT NULL DEFAULT nextval('{TABLE}_id_seq'),
+    item_name TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    amount NUMERIC(10, 2) NOT NULL,
+    sale_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    employee_id INTEGER NOT NULL,
+    PRIMARY KEY (id, sale_date)
+) PARTITION BY RANGE (sale_date);
+ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id;
+CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT;
+CREATE INDEX {TABLE}_sale_date_idx ON {TABLE} (sale_date);
+CREATE INDEX {TABLE}_employee_id_idx ON {TABLE} (employee_id, sale_date);
+"""
+COLUMNS = "id, item_name, quantity, amount, sale_date, employee_id"
+
+
+def bucket_start(day, granularity: str) -> date:
+    day = day.date() if isinstance(day, datetime) else day
+    return day.replace(day=1) if granularity == "month" else day
+
+
+def next_bucket(start: date, granularity: str) -> date:
+    if granularity == "day":
+        return start + timedelta(days=1)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def partition_name(start: date, granularity: str) -> str:
+    return f"{TABLE}_p{start:%Y_%m}" if granularity == "month" else f"{TABLE}_p{start:%Y_%m_%d}"
+
+
+def partition_granularity(cur):
+    # "month" or "day" from the existing partition names; None when sales isn't partitioned.
+    cur.execute("SELECT c.relkind FROM pg_class c WHERE c.oid = to_regclass(%s)", (TABLE,))
+    row = cur.fetchone()
+    if not row or row[0] != "p":
+        return None
+    cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(%s)", (TABLE,))
+    for (name,) in cur.fetchall():
+        match = _PARTITION_NAME.match(name)
+        if match:
+            return "day" if match.group(3) else "month"
+    return "month"
+
+
+def ensure_partitions(cur, first, last, granularity: str) -> list:
+    # Creates any missing partitions covering [first, last]. Rows that already
+    # landed in the default partition for a new range are moved into it, since
+    # Postgres refuses to add a partition the default still holds rows for.
+    created = []
+    start = bucket_start(first, granularity)
+    last = bucket_start(last, granularity)
+    while start <= last:
+        end = next_bucket(start, granularity)
+        name = partition_name(start, granularity)
+        cur.execute("SELECT to_regclass(%s)", (name,))
+        if cur.fetchone()[0] is None:
+            cur.execute(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+            cur.execute(f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE sale_date >= %s AND sale_date < %s "
+                        f"RETURNING {COLUMNS}) INSERT INTO {name} ({COLUMNS}) SELECT {COLUMNS} FROM moved",
+                        (start, end))
+            if cur.rowcount:
+                logger.info(f"Moved {cur.rowcount} rows from {DEFAULT_PARTITION} into {name}.")
+            # Attaching also builds the parent's indexes on the new partition.
+            cur.execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (start, end))
+            created.append(name)
+        start = end
+    if created:
+        logger.info(f"Created partitions {', '.join(created)}.")
+    return created
+
+
+def prepare_load(cur, timestamps, granularity: str = None) -> list:
+    # Called by loaders before inserting a batch: rows inserted through sales
+    # are routed by Postgres, so each one lands in its own partition rather
+    # than the default as long as the partition exists.
+    granularity = granularity or partition_granularity(cur)
+    timestamps = [t for t in timestamps if t is not None]
+    if granularity is None or not timestamps:
+        return []
+    return ensure_partitions(cur, min(timestamps), max(timestamps), granularity)
+
+
+def _ahead(granularity: str, ahead: int) -> date:
+    last = bucket_start(date.today(), granularity)
+    for _ in range(ahead):
+        last = next_bucket(last, granularity)
+    return last
+
+
+def migrate(conn, granularity: str = "month", ahead: int = 3, keep_old: bool = False):
+    # Converts a plain sales table into range partitions on sale_date, in one
+    # transaction (sales is locked for the copy). Partitions cover the
+    # existing data plus `ahead` future periods; the default partition catches
+    # anything outside them until `maintain` or a loader adds the partition.
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown partition granularity: {granularity}")
+    with conn.cursor() as cur:
+        current = partition_granularity(cur)
+        if current is not None:
+            logger.info(f"{TABLE} is already partitioned by {current}; adding future partitions only.")
+            created = ensure_partitions(cur, date.today(), _ahead(current, ahead), current)
+            conn.commit()
+            return created
+
+        cur.execute(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE")
+        cur.execute(f"SELECT count(*) FILTER (WHERE sale_date IS NULL), min(sale_date), max(sale_date), max(id) FROM {TABLE}")
+        nulls, first, last, max_id = cur.fetchone()
+        if nulls:
+            raise ValueError(f"{nulls} sales rows have no sale_date; set one before partitioning.")
+        cur.execute("SELECT to_regclass('table_versions') IS NOT NULL")
+        has_versions = cur.fetchone()[0]
+        channel = trigger_channel(cur)
+
+        old = f"{TABLE}_unpartitioned"
+        cur.execute(f"ALTER TABLE {TABLE} RENAME TO {old}")
+        # The old table's constraint, index and sequence names would collide with the new ones.
+        cur.execute(f"ALTER TABLE {old} RENAME CONSTRAINT {TABLE}_pkey TO {old}_pkey")
+        cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (old,))
+        sequence = cur.fetchone()[0]
+        if sequence:
+            cur.execute(f"ALTER SEQUENCE {sequence} RENAME TO {old}_id_seq")
+        cur.execute(PARTITIONED_DDL)
+
+        created = ensure_partitions(cur, first or date.today(), _ahead(granularity, ahead), granularity)
+        cur.execute(f"INSERT INTO {TABLE} ({COLUMNS}) SELECT {COLUMNS} FROM {old}")
+        copied = cur.rowcount
+        cur.execute(f"SELECT setval('{TABLE}_id_seq', %s)", (max_id or 1,))
+        if not keep_old:
+            cur.execute(f"DROP TABLE {old}")
+        if has_versions:
+            # Recreates the version/notify trigger on the new table, on the channel it used before.
+            cur.execute(versions_sql(channel) if channel else versions_sql())
+    conn.commit()
+    with conn.cursor() as cur:
+        cur.execute(f"ANALYZE {TABLE}")
+    conn.commit()
+    logger.info(f"Partitioned {copied} {TABLE} rows by {granularity} into {len(created)} partitions "
+                f"({first} to {last}).")
+    return created
+
+
+def maintain(conn, ahead: int = 3) -> list:
+    # For cron: keeps `ahead` future partitions in place.
+    with conn.cursor() as cur:
+        granularity = partition_granularity(cur)
+        if granularity is None:
+            logger.info(f"{TABLE} is not partitioned; nothing to do.")
+            return []
+        created = ensure_partitions(cur, date.today(), _ahead(granularity, ahead), granularity)
+    conn.commit()
+    return created
+
+
+def main():
+    import psycopg2
+    from app.utils import load_config
+
+    parser = argparse.ArgumentParser(description="Range-partition the sales table on sale_date.")
+    parser.add_argument("command", choices=["migrate", "maintain"])
+    parser.add_argument("--config", default=str(BACKEND_DIR / "config.json"))
+    parser.add_argument("--by", choices=GRANULARITIES, help="partition size (default PARTITION_GRANULARITY)")
+    parser.add_argument("--ahead", type=int, help="future partitions to pre-create (default PARTITION_AHEAD)")
+    parser.add_argument("--keep-old", action="store_true", help="keep the original table as sales_unpartitioned")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = load_config(args.config)
+    ahead = args.ahead if args.ahead is not None else int(config.get("PARTITION_AHEAD", 3))
+    conn = psycopg2.connect(host=config.get("DB_HOST", "localhost"), port=config.get("DB_PORT", "5432"),
+                            dbname=config.get("DB_NAME"), user=config.get("DB_USER"),
+                            password=config.get("DB_PASSWORD"))
+    try:
+        if args.command == "migrate":
+            migrate(conn, args.by or config.get("PARTITION_GRANULARITY", "month"), ahead, args.keep_old)
+        else:
+            maintain(conn, ahead)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
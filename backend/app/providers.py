@@ -0,0 +1,145 @@
+from app.llm_client import LLMClient
+from pathlib import Path
+import threading
+import hashlib
+import random
+import re
+import time
+import logging
+import json
+
+logger = logging.getLogger(__name__)
+_PANEL_LINE = re.compile(r"^panel ([\w-]+): (.*)$", re.M)
+BACKEND_DIR = Path(__file__).parent.parent
+
+
+class CassetteMiss(LookupError):
+    pass
+
+
+class OpenAIProvider:
+    # Any endpoint speaking the OpenAI chat-completions protocol.
+    def __init__(self, client: LLMClient, model: str = "gpt-4"):
+        self.client = client
+        self.model = model
+
+    def complete(self, messages: list, max_tokens: int = 500) -> str:
+        data = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": 0,
+            "n": 1,
+            "max_tokens": max_tokens,
+        }
+        body = self.client.post(data)
+        return body["choices"][0]["message"]["content"]
+
+    def close(self):
+        self.client.close()
+
+
+class StubProvider:
+    # Offline and deterministic: the longest canned prompt contained in the
+    # user message wins, after sleeping for the configured latency.
+    def __init__(self, responses: dict, default: str = "", latency_ms: float = 0, jitter_ms: float = 0, seed: int = 0):
+        self.responses = {" ".join(k.lower().split()): v for k, v in responses.items()}
+        self.default = default
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path) as f:
+            spec = json.load(f)
+        return cls(spec.get("responses", {}), spec.get("default", ""), **kwargs)
+
+    def complete(self, messages: list, max_tokens: int = 500) -> str:
+        content = messages[-1]["content"]
+        panels = _PANEL_LINE.findall(content)
+        if panels:
+            answer = "\n".join(f"```sql\n-- panel: {name}\n{self._match(prompt)}\n```" for name, prompt in panels)
+        else:
+            answer = f"```sql\n{self._match(content)}\n```"
+        if self.latency_ms or self.jitter_ms:
+            with self._lock:
+                jitter = self._random.uniform(0, self.jitter_ms)
+            time.sleep((self.latency_ms + jitter) / 1000)
+        return answer
+
+    def _match(self, text: str) -> str:
+        text = " ".join(text.lower().split())
+        matches = [k for k in self.responses if k in text]
+        return self.responses[max(matches, key=len)] if matches else self.default
+
+    def close(self):
+        pass
+
+
+class CassetteProvider:
+    # "record" passes calls through to the inner provider and stores the
+    # responses; "replay" serves them back and never touches the network.
+    def __init__(self, path, mode: str, inner=None):
+        self.path = Path(path)
+        self.mode = mode
+        self.inner = inner
+        self._lock = threading.Lock()
+        self._entries = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self._entries = json.load(f)
+        logger.info(f"Cassette {self.path} opened in {mode} mode with {len(self._entries)} entries.")
+
+    @staticmethod
+    def key(messages: list, max_tokens: int) -> str:
+        raw = json.dumps({"messages": messages, "max_tokens": max_tokens}, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def complete(self, messages: list, max_tokens: int = 500) -> str:
+        key = self.key(messages, max_tokens)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and self.mode == "replay":
+            return entry["response"]
+        if self.mode == "replay":
+            raise CassetteMiss(f"No cassette entry for request {key[:12]}")
+
+        response = self.inner.complete(messages, max_tokens)
+        with self._lock:
+            self._entries[key] = {"request": messages[-1]["content"], "response": response}
+            self._save()
+        return response
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self._entries, f, indent=2, sort_keys=True)
+        tmp.replace(self.path)
+
+    def close(self):
+        if self.inner:
+            self.inner.close()
+
+
+def create_provider(config: dict):
+    name = config.get("LLM_PROVIDER", "openai")
+    if name == "openai":
+        provider = OpenAIProvider(LLMClient.from_config(config), config.get("LLM_MODEL", "gpt-4"))
+    elif name == "stub":
+        provider = StubProvider.from_file(
+            BACKEND_DIR / config.get("LLM_STUB_RESPONSES", "stub_responses.json"),
+            latency_ms=float(config.get("LLM_STUB_LATENCY_MS", 0)),
+            jitter_ms=float(config.get("LLM_STUB_JITTER_MS", 0)),
+        )
+    else:
+        raise ValueError(f"Unknown LLM_PROVIDER: {name}")
+
+    cassette_mode = config.get("LLM_CASSETTE_MODE", "off")
+    if cassette_mode in ("record", "replay"):
+        provider = CassetteProvider(BACKEND_DIR / config.get("LLM_CASSETTE_PATH", "cassettes/llm.json"),
+                                    cassette_mode, provider)
+    elif cassette_mode != "off":
+        raise ValueError(f"Unknown LLM_CASSETTE_MODE: {cassette_mode}")
+    return provider
@@ -0,0 +1,230 @@
+from pathlib import Path
+from collections import defaultdict, OrderedDict
+import argparse
+import threading
+import hashlib
+import queue
+import time
+import logging
+import json
+import re
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+BACKEND_DIR = Path(__file__).parent.parent
+QUERY_LOG = None
+
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"(?<![\w.])[-+]?\d+(?:\.\d+)?(?:e[-+]?\d+)?\b", re.I)
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(sql: str):
+    # Literals become "?" so queries differing only in dates, names or limits group together.
+    text = _COMMENTS.sub(" ", sql or "")
+    text = _STRINGS.sub("?", text)
+    text = _NUMBERS.sub("?", text)
+    text = _SPACES.sub(" ", text).strip().rstrip(";").strip().lower()
+    text = _IN_LISTS.sub("(?+)", text)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16], text
+
+
+class QueryLog:
+    # Records are queued by request threads and written (plus EXPLAINed, when
+    # enabled) by one background thread, keeping both off the request path.
+    # Plan costs are reused per SQL text for explain_ttl seconds, and 304s and
+    # result-cache hits, which ran nothing, aren't EXPLAINed at all.
+    def __init__(self, path, explain=None, explain_ttl: float = 600, explain_cache_entries: int = 1000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.explain = explain
+        self.explain_ttl = explain_ttl
+        self.explain_cache_entries = explain_cache_entries
+        self._costs = OrderedDict()
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = threading.Thread(target=self._writer, name="query-log", daemon=True)
+        self._thread.start()
+
+    def record(self, prompt: str, sql: str, rows: int = None, size: int = 0, stages=None, error: str = None,
+               elapsed: float = None, **extra):
+        # rows is None when nothing was fetched (errors, 304s, result-cache hits).
+        fp, fp_text = fingerprint(sql)
+        entry = {
+            "ts": time.time(),
+            "prompt": prompt,
+            "sql": sql,
+            "fingerprint": fp,
+            "fingerprint_text": fp_text,
+            "rows": rows,
+            "bytes": size,
+            "elapsed_ms": round(elapsed * 1000, 3) if elapsed is not None else None,
+            "stages_ms": {k: round(v * 1000, 3) for k, v in (stages or {}).items()},
+            "error": error,
+        }
+        entry.update(extra)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            logger.warning("Query log queue full; dropping record.")
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _writer(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                entry = self._queue.get()
+                if entry is None:
+                    break
+                if self.explain and not entry["error"] and not entry.get("not_modified") \
+                        and not entry.get("result_cache"):
+                    entry["plan_cost"] = self._plan_cost(entry)
+                f.write(json.dumps(entry, default=str) + "\n")
+                if self._queue.empty():
+                    f.flush()
+
+
+    def _plan_cost(self, entry):
+        sql = entry["sql"]
+        cached = self._costs.get(sql)
+        if cached is not None and time.monotonic() - cached[1] < self.explain_ttl:
+            self._costs.move_to_end(sql)
+            return cached[0]
+        try:
+            cost = self.explain(sql)
+        except Exception as e:
+            logger.debug(f"EXPLAIN failed for {entry['fingerprint']}: {e}")
+            return None
+        self._costs[sql] = (cost, time.monotonic())
+        self._costs.move_to_end(sql)
+        while len(self._costs) > self.explain_cache_entries:
+            self._costs.popitem(last=False)
+        return cost
+
+
+def init_query_log(config: dict, explain=None):
+    global QUERY_LOG
+    if not config.get("QUERY_LOG_ENABLED", True):
+        return
+    path = BACKEND_DIR / config.get("QUERY_LOG_PATH", "logs/queries.jsonl")
+    QUERY_LOG = QueryLog(path, explain if config.get("QUERY_LOG_EXPLAIN", True) else None,
+                         explain_ttl=float(config.get("QUERY_LOG_EXPLAIN_TTL_SECONDS", 600)))
+    logger.info(f"Query log writing to {path}")
+
+def close_query_log():
+    global QUERY_LOG
+    if QUERY_LOG:
+        QUERY_LOG.close()
+        QUERY_LOG = None
+
+def log_query(prompt: str, sql: str, **kwargs):
+    if QUERY_LOG:
+        kwargs.setdefault("elapsed", metrics.request_elapsed())
+        QUERY_LOG.record(prompt, sql, **kwargs)
+
+
+def read_entries(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def _p99(values):
+    ordered = sorted(values)
+    return ordered[max(0, int(round(0.99 * len(ordered))) - 1)]
+
+
+def _elapsed_ms(entry) -> float:
+    # Stages nest (db work runs inside etag and the scheduler queue), so they
+    # can't be summed. Records written before elapsed_ms existed fall back to
+    # their longest stage, a lower bound.
+    if entry.get("elapsed_ms") is not None:
+        return entry["elapsed_ms"]
+    return max(entry.get("stages_ms", {}).values(), default=0.0)
+
+
+def summarize(entries, since: float = 0):
+    groups = defaultdict(lambda: {"times": [], "rows": [], "bytes": 0, "errors": 0, "costs": [], "prompts": defaultdict(int)})
+    for entry in entries:
+        if entry.get("ts", 0) < since:
+            continue
+        group = groups[entry["fingerprint"]]
+        group["text"] = entry["fingerprint_text"]
+        group["sql"] = entry["sql"]
+        group["times"].append(_elapsed_ms(entry))
+        if entry.get("rows") is not None:
+            # Only records that fetched rows; 304s and cache hits would drag the mean towards 0.
+            group["rows"].append(entry["rows"])
+        group["bytes"] += entry.get("bytes", 0)
+        group["errors"] += 1 if entry.get("error") else 0
+        group["prompts"][entry.get("prompt", "")] += 1
+        if entry.get("plan_cost") is not None:
+            group["costs"].append(entry["plan_cost"])
+
+    report = []
+    for fp, group in groups.items():
+        times = group["times"]
+        report.append({
+            "fingerprint": fp,
+            "text": group["text"],
+            "sql": group["sql"],
+            "count": len(times),
+            "total_ms": sum(times),
+            "mean_ms": sum(times) / len(times),
+            "p99_ms": _p99(times),
+            "mean_rows": sum(group["rows"]) / len(group["rows"]) if group["rows"] else None,
+            "mean_bytes": group["bytes"] / len(times),
+            "mean_plan_cost": sum(group["costs"]) / len(group["costs"]) if group["costs"] else None,
+            "errors": group["errors"],
+            "top_prompt": max(group["prompts"], key=group["prompts"].get),
+        })
+    return report
+
+
+SORT_KEYS = {"total": "total_ms", "p99": "p99_ms", "count": "count"}
+
+
+def top(path, by: str = "total", limit: int = 20, since: float = 0):
+    report = summarize(read_entries(path), since)
+    report.sort(key=lambda r: r[SORT_KEYS[by]], reverse=True)
+    return report[:limit]
+
+
+def main():
+    from app.utils import load_config
+
+    parser = argparse.ArgumentParser(description="Report the most expensive generated-SQL fingerprints.")
+    parser.add_argument("--config", default=str(BACKEND_DIR / "config.json"))
+    parser.add_argument("--path", help="query log to read (default QUERY_LOG_PATH)")
+    parser.add_argument("--by", choices=sorted(SORT_KEYS), default="total")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--hours", type=float, default=0, help="only consider the last N hours")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    path = args.path or BACKEND_DIR / load_config(args.config).get("QUERY_LOG_PATH", "logs/queries.jsonl")
+    since = time.time() - args.hours * 3600 if args.hours else 0
+    rows = top(path, args.by, args.top, since)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    print(f"{'fingerprint':<16} {'count':>7} {'total_ms':>11} {'mean_ms':>9} {'p99_ms':>9} {'rows':>8} {'cost':>10}  query")
+    for r in rows:
+        cost = f"{r['mean_plan_cost']:.1f}" if r["mean_plan_cost"] is not None else "-"
+        mean_rows = f"{r['mean_rows']:.0f}" if r["mean_rows"] is not None else "-"
+        print(f"{r['fingerprint']:<16} {r['count']:>7} {r['total_ms']:>11.1f} {r['mean_ms']:>9.1f} "
+              f"{r['p99_ms']:>9.1f} {mean_rows:>8} {cost:>10}  {r['text'][:100]}")
+
+
+if __name__ == "__main__":
+    main()
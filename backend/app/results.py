@@ -0,0 +1,247 @@
+from app.encoding import orjson, json_default
+from app.utils import private_dir
+from pathlib import Path
+from decimal import Decimal
+import threading
+import datetime
+import logging
+import json
+import time
+import uuid
+import re
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+RESULT_LIMITS = None
+RESULT_ID = re.compile(r"^[0-9a-f]{32}$")
+
+# Rough CPython footprint of fetched values; only the order of magnitude matters.
+_TUPLE_OVERHEAD = 56
+_SAMPLE_ROWS = 20
+
+
+def _value_size(value) -> int:
+    if value is None or isinstance(value, bool):
+        return 8
+    if isinstance(value, str):
+        return 57 + len(value)
+    if isinstance(value, (int, float)):
+        return 32
+    if isinstance(value, Decimal):
+        return 112
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return 56
+    if isinstance(value, (list, tuple)):
+        return 64 + sum(_value_size(v) for v in value)
+    return 64 + len(str(value))
+
+
+def estimate_size(rows: list) -> int:
+    # Sizes a sample of the batch and scales up, so accounting stays cheap
+    # next to the fetch itself.
+    if not rows:
+        return 0
+    sample = rows[:_SAMPLE_ROWS]
+    per_row = sum(_TUPLE_OVERHEAD + 8 * len(r) + sum(_value_size(v) for v in r) for r in sample) / len(sample)
+    return int(per_row * len(rows))
+
+
+class ResultLimits:
+    # Byte budgets for fetched rows: one per request and one shared by every
+    # request in this worker process.
+    def __init__(self, request_bytes: int, process_bytes: int, overflow: str = "spill", fetch_rows: int = 2000,
+                 spill_dir=None, spill_ttl: float = 900):
+        if overflow not in ("spill", "truncate"):
+            raise ValueError(f"Unknown RESULT_OVERFLOW: {overflow}")
+        self.request_bytes = request_bytes
+        self.process_bytes = process_bytes
+        self.overflow = overflow
+        self.fetch_rows = fetch_rows
+        # Private to the app: spill files are served back by id.
+        self.spill_dir = Path(spill_dir or Path(__file__).parent.parent / "cache" / "results")
+        self.spill_ttl = spill_ttl
+        self.in_use = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes: int) -> bool:
+        with self._lock:
+            if self.in_use + nbytes > self.process_bytes:
+                return False
+            self.in_use += nbytes
+            return True
+
+    def release(self, nbytes: int):
+        with self._lock:
+            self.in_use -= nbytes
+
+
+class ResultBudget:
+    # Per-request accounting, released when the request is done with its rows.
+    def __init__(self, limits: ResultLimits, overflow: str = None):
+        self.limits = limits
+        self.overflow = overflow or limits.overflow
+        self.reserved = 0
+        self.truncated = False
+        self.spill = None
+
+    @property
+    def overflowed(self) -> bool:
+        return self.truncated or self.spill is not None
+
+    def admit(self, rows: list) -> bool:
+        nbytes = estimate_size(rows)
+        if self.reserved + nbytes > self.limits.request_bytes or not self.limits.reserve(nbytes):
+            return False
+        self.reserved += nbytes
+        return True
+
+    def release(self):
+        if self.reserved:
+            self.limits.release(self.reserved)
+            self.reserved = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def new_budget(overflow: str = None):
+    # overflow="truncate" for callers that post-process rows and can't use a spill file.
+    return ResultBudget(RESULT_LIMITS, overflow) if RESULT_LIMITS is not None else None
+
+
+def fetch_rows(cur, budget: ResultBudget = None):
+    # fetchall() when unbudgeted; otherwise batches of fetch_rows, charged to
+    # the budget as they arrive. Past the budget the rows either stream to a
+    # spill file (budget.spill, and the rows returned are empty) or stop
+    # (budget.truncated, and the rows returned are those within budget).
+    if budget is None:
+        return cur.fetchall()
+    rows = []
+    while True:
+        batch = cur.fetchmany(budget.limits.fetch_rows)
+        if not batch:
+            if budget.spill is not None:
+                budget.spill.close()
+            return rows
+        if budget.spill is None and budget.admit(batch):
+            rows.extend(batch)
+            continue
+        if budget.overflow == "truncate":
+            budget.truncated = True
+            return rows
+        if budget.spill is None:
+            budget.spill = SpillFile.create(budget.limits, [d[0] for d in cur.description])
+            budget.spill.write(rows)
+            rows = []
+            budget.release()
+            logger.warning(f"Result exceeded its memory budget; spilling to {budget.spill.path.name}")
+        budget.spill.write(batch)
+
+
+class SpillFile:
+    # Parquet when pyarrow is installed, JSON lines otherwise. Parquet column
+    # types come from the first batch; later batches are cast to them.
+    def __init__(self, path: Path, columns: list, fmt: str):
+        self.path = path
+        self.columns = columns
+        self.format = fmt
+        self.rows = 0
+        self._writer = None
+        self._file = None
+
+    @classmethod
+    def create(cls, limits: ResultLimits, columns: list):
+        private_dir(limits.spill_dir)
+        _sweep(limits.spill_dir, limits.spill_ttl)
+        result_id = uuid.uuid4().hex
+        fmt = "parquet" if pyarrow is not None else "jsonl"
+        return cls(limits.spill_dir / f"{result_id}.{fmt}", columns, fmt)
+
+    @property
+    def result_id(self) -> str:
+        return self.path.stem
+
+    def write(self, rows: list):
+        if not rows:
+            return
+        self.rows += len(rows)
+        if self.format == "parquet":
+            data = {name: [_arrow_value(row[i]) for row in rows] for i, name in enumerate(self.columns)}
+            if self._writer is None:
+                table = pyarrow.table(data)
+                # All-NULL columns in the first batch would pin a null type; widen them to string.
+                schema = pyarrow.schema([f.with_type(pyarrow.string()) if pyarrow.types.is_null(f.type) else f
+                                         for f in table.schema])
+                table = table.cast(schema)
+                self._writer = pyarrow.parquet.ParquetWriter(self.path, schema)
+            else:
+                table = pyarrow.table(data).cast(self._writer.schema, safe=False)
+            self._writer.write_table(table)
+            return
+        if self._file is None:
+            self._file = open(self.path, "wb")
+        for row in rows:
+            record = dict(zip(self.columns, row))
+            if orjson is not None:
+                self._file.write(orjson.dumps(record, default=json_default) + b"\n")
+            else:
+                self._file.write(json.dumps(record, default=json_default).encode("utf-8") + b"\n")
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+
+    def describe(self) -> dict:
+        return {"spilled": True, "result_id": self.result_id, "url": f"/api/results/{self.result_id}",
+                "format": self.format, "rows": self.rows, "columns": self.columns}
+
+
+def _arrow_value(value):
+    return float(value) if isinstance(value, Decimal) else value
+
+
+def _sweep(directory: Path, ttl: float):
+    cutoff = time.time() - ttl
+    for path in directory.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass
+
+
+def spilled_path(result_id: str):
+    # Path of a live spill file, or None (unknown, expired or malformed id).
+    if RESULT_LIMITS is None or not RESULT_ID.match(result_id):
+        return None
+    for fmt in ("parquet", "jsonl"):
+        path = RESULT_LIMITS.spill_dir / f"{result_id}.{fmt}"
+        if path.exists() and path.stat().st_mtime >= time.time() - RESULT_LIMITS.spill_ttl:
+            return path
+    return None
+
+
+def init_result_limits(config: dict):
+    global RESULT_LIMITS
+    if not config.get("RESULT_BUDGET_ENABLED", True):
+        return
+    RESULT_LIMITS = ResultLimits(
+        request_bytes=int(config.get("RESULT_MAX_BYTES", 64 * 1024 * 1024)),
+        process_bytes=int(config.get("RESULT_PROCESS_MAX_BYTES", 512 * 1024 * 1024)),
+        overflow=config.get("RESULT_OVERFLOW", "spill"),
+        fetch_rows=int(config.get("RESULT_FETCH_ROWS", 2000)),
+        spill_dir=config.get("RESULT_SPILL_DIR") or None,
+        spill_ttl=float(config.get("RESULT_SPILL_TTL_SECONDS", 900)),
+    )
+    logger.info(f"Result budget: {RESULT_LIMITS.request_bytes} bytes per request, "
+                f"{RESULT_LIMITS.process_bytes} per process, overflow={RESULT_LIMITS.overflow}")
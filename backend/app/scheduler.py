@@ -0,0 +1,244 @@
+from app import metrics
+from contextlib import contextmanager
+import threading
+import logging
+import math
+import time
+import itertools
+
+logger = logging.getLogger(__name__)
+SCHEDULER = None
+OTHER_TENANTS = "other"
+
+
+class QuotaExceeded(Exception):
+    # Answered with 429 (quota, queue full) or 503 (waited too long) plus Retry-After.
+    def __init__(self, message: str, retry_after: float, status: int = 429):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.status = status
+
+
+class _Waiter:
+    __slots__ = ("tenant", "start", "finish", "seq", "granted")
+
+    def __init__(self, tenant, start, finish, seq):
+        self.tenant = tenant
+        self.start = start
+        self.finish = finish
+        self.seq = seq
+        self.granted = False
+
+
+class _Tenant:
+    __slots__ = ("active", "queued", "finish")
+
+    def __init__(self):
+        self.active = 0
+        self.queued = 0
+        self.finish = 0.0
+
+
+class FairQueue:
+    # Weighted fair queuing over `capacity` slots of one resource (LLM calls
+    # or database connections). Each request gets a virtual finish time of
+    # max(now, tenant's last finish) + cost / weight and free slots go to the
+    # smallest one, so a tenant submitting many requests only delays its own.
+    # A tenant holds at most max_concurrent slots and may have max_queued
+    # requests waiting; past that it is told to retry.
+    def __init__(self, name: str, capacity: int, max_concurrent: int, max_queued: int, timeout: float, weight):
+        self.name = name
+        self.capacity = capacity
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.weight = weight
+        self.in_use = 0
+        self.virtual_time = 0.0
+        self.hold_seconds = 1.0
+        self._tenants = {}
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self, tenant: str, label: str, cost: float = 1.0):
+        waited = self._acquire(tenant, label, cost)
+        metrics.SCHEDULER_WAIT_SECONDS.observe(waited, resource=self.name, tenant=label)
+        metrics.record_stage(f"{self.name}_queue", waited)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(tenant, time.monotonic() - start)
+
+    def _acquire(self, tenant: str, label: str, cost: float) -> float:
+        with self._cond:
+            state = self._tenants.setdefault(tenant, _Tenant())
+            if state.queued >= self.max_queued:
+                metrics.SCHEDULER_REJECTIONS.inc(resource=self.name, tenant=label, reason="queue_full")
+                raise QuotaExceeded(f"Too many queued {self.name} requests for {tenant}.",
+                                    self.hold_seconds * (state.queued + 1) / max(1, self.max_concurrent))
+            start = max(self.virtual_time, state.finish)
+            waiter = _Waiter(tenant, start, start + cost / self.weight(tenant), next(self._seq))
+            state.finish = waiter.finish
+            state.queued += 1
+            self._waiting.append(waiter)
+            metrics.SCHEDULER_QUEUE_DEPTH.set(state.queued, resource=self.name, tenant=label)
+            self._dispatch()
+
+            began = time.monotonic()
+            deadline = began + self.timeout
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(waiter)
+                    state.queued -= 1
+                    if not state.active and not state.queued:
+                        del self._tenants[tenant]
+                    metrics.SCHEDULER_QUEUE_DEPTH.set(state.queued, resource=self.name, tenant=label)
+                    metrics.SCHEDULER_REJECTIONS.inc(resource=self.name, tenant=label, reason="timeout")
+                    raise QuotaExceeded(f"Timed out waiting for a {self.name} slot.", self.hold_seconds, status=503)
+                self._cond.wait(remaining)
+            metrics.SCHEDULER_QUEUE_DEPTH.set(state.queued, resource=self.name, tenant=label)
+            return time.monotonic() - began
+
+    def _dispatch(self):
+        # Caller holds the lock. Grants free slots in finish-time order,
+        # skipping tenants already at their concurrency limit.
+        granted = False
+        while self.in_use < self.capacity:
+            eligible = [w for w in self._waiting if self._tenants[w.tenant].active < self.max_concurrent]
+            if not eligible:
+                break
+            waiter = min(eligible, key=lambda w: (w.finish, w.seq))
+            self._waiting.remove(waiter)
+            state = self._tenants[waiter.tenant]
+            state.queued -= 1
+            state.active += 1
+            self.in_use += 1
+            self.virtual_time = max(self.virtual_time, waiter.start)
+            waiter.granted = granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _release(self, tenant: str, held: float):
+        with self._cond:
+            state = self._tenants[tenant]
+            state.active -= 1
+            self.in_use -= 1
+            # Used for Retry-After estimates only.
+            self.hold_seconds = 0.9 * self.hold_seconds + 0.1 * held
+            if not state.active and not state.queued and state.finish <= self.virtual_time:
+                del self._tenants[tenant]
+            self._dispatch()
+
+
+class TokenBuckets:
+    # Per-tenant LLM token quota, refilled continuously at rate per second.
+    def __init__(self, per_minute: float, burst: float = None):
+        self.rate = per_minute / 60
+        self.burst = burst or per_minute
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, tenant: str, tokens: float) -> float:
+        # 0 when granted, otherwise seconds until the bucket would cover it.
+        # A request larger than the burst is charged the whole burst, so it can still run.
+        tokens = min(tokens, self.burst)
+        now = time.monotonic()
+        with self._lock:
+            level, last = self._buckets.get(tenant, (self.burst, now))
+            level = min(self.burst, level + (now - last) * self.rate)
+            if tokens > level:
+                self._buckets[tenant] = (level, now)
+                return (tokens - level) / self.rate
+            self._buckets[tenant] = (level - tokens, now)
+            return 0.0
+
+
+class Scheduler:
+    def __init__(self, config: dict):
+        self.header = config.get("TENANT_HEADER", "X-User")
+        self.api_keys = config.get("TENANT_API_KEYS", {})
+        # Tenants (by API key) allowed to name their end users in the identity header.
+        self.proxies = set(config.get("TENANT_PROXIES", []))
+        self.weights = config.get("TENANT_WEIGHTS", {})
+        self.metric_tenants = int(config.get("SCHEDULER_METRIC_TENANTS", 100))
+        self._labels = set()
+        per_minute = float(config.get("TENANT_LLM_TOKENS_PER_MINUTE", 0))
+        self.tokens = TokenBuckets(per_minute) if per_minute else None
+        queue_args = dict(max_concurrent=int(config.get("TENANT_MAX_CONCURRENT", 2)),
+                          max_queued=int(config.get("TENANT_MAX_QUEUED", 10)),
+                          timeout=float(config.get("TENANT_QUEUE_TIMEOUT_SECONDS", 30)),
+                          weight=self.weight)
+        self.queues = {
+            "llm": FairQueue("llm", int(config.get("SCHEDULER_LLM_SLOTS", config.get("LLM_MAX_CONCURRENCY", 4))),
+                             **queue_args),
+            "db": FairQueue("db", int(config.get("SCHEDULER_DB_SLOTS", config.get("DB_POOL_MAX", 10))),
+                            **queue_args),
+        }
+
+    def tenant(self, headers, client_host: str = None) -> str:
+        # API key first (mapped to its tenant), else the client address. The
+        # identity header is only honoured from a proxy tenant (e.g. the
+        # dashboard), whose users become "<proxy>/<user>"; anyone else could
+        # rotate it per request to dodge the quotas.
+        api_key = headers.get("x-api-key")
+        if api_key and api_key in self.api_keys:
+            tenant = self.api_keys[api_key]
+            user = headers.get(self.header)
+            return f"{tenant}/{user}" if user and tenant in self.proxies else tenant
+        return client_host or "anonymous"
+
+    def weight(self, tenant: str) -> float:
+        # A proxy's users inherit the proxy's weight unless listed themselves.
+        return float(self.weights.get(tenant, self.weights.get(tenant.split("/")[0], 1.0)))
+
+    def label(self, tenant: str) -> str:
+        # Bounded metric cardinality: the first metric_tenants tenants get their own series.
+        if tenant in self._labels:
+            return tenant
+        if len(self._labels) < self.metric_tenants:
+            self._labels.add(tenant)
+            return tenant
+        return OTHER_TENANTS
+
+    def charge_tokens(self, tenant: str, tokens: float):
+        if self.tokens is None:
+            return
+        retry_after = self.tokens.take(tenant, tokens)
+        if retry_after:
+            metrics.SCHEDULER_REJECTIONS.inc(resource="llm", tenant=self.label(tenant), reason="tokens")
+            raise QuotaExceeded(f"LLM token quota exhausted for {tenant}.", retry_after)
+
+    def slot(self, resource: str, tenant: str, cost: float = 1.0):
+        return self.queues[resource].slot(tenant, self.label(tenant), cost)
+
+
+def init_scheduler(config: dict):
+    global SCHEDULER
+    if config.get("SCHEDULER_ENABLED", True):
+        SCHEDULER = Scheduler(config)
+        logger.info(f"Fair scheduler: {SCHEDULER.queues['llm'].capacity} LLM / {SCHEDULER.queues['db'].capacity} "
+                    f"database slots, {SCHEDULER.queues['db'].max_concurrent} per tenant.")
+
+def tenant_of(request) -> str:
+    if SCHEDULER is None:
+        return "anonymous"
+    return SCHEDULER.tenant(request.headers, request.client.host if request.client else None)
+
+def llm_tokens(*texts, max_tokens: int = 500) -> int:
+    # Rough prompt size (4 characters a token) plus the completion allowance.
+    return sum(len(t) for t in texts) // 4 + max_tokens
+
+@contextmanager
+def scheduled(resource: str, tenant: str, tokens: float = 0):
+    # Token quota first (fails fast), then a fair-queued slot for the work inside.
+    if SCHEDULER is None:
+        yield
+        return
+    if tokens:
+        SCHEDULER.charge_tokens(tenant, tokens)
+    with SCHEDULER.slot(resource, tenant):
+        yield
@@ -0,0 +1,273 @@
+from app.sqltools import referenced_tables, referenced_columns
+from app.shared_cache import shared_key
+from app import shared_cache
+from collections import Counter, OrderedDict
+import threading
+import logging
+import sqlite3
+import math
+import time
+import json
+import re
+
+logger = logging.getLogger(__name__)
+SQL_CACHE = None
+
+_DATES = re.compile(r"\b\d{4}-\d{2}-\d{2}\b")
+_NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_QUOTED = re.compile(r"'([^']*)'|\"([^\"]*)\"")
+_TOKENS = re.compile(r"[a-z]+")
+
+# Everyday words for schema concepts; anything else must match the schema's own names.
+SYNONYMS = {
+    "product": "item", "sell": "sale", "sold": "sale", "selling": "sale", "sale": "sale", "seller": "employee",
+    "revenue": "amount", "staff": "employee", "worker": "employee", "unit": "quantity",
+    "joined": "created", "hired": "created",
+}
+
+# Prompts asking for different aggregates never share SQL.
+AGGREGATES = {
+    "total": "sum", "sum": "sum", "much": "sum", "average": "avg", "avg": "avg", "mean": "avg",
+    "count": "count", "number": "count", "many": "count", "max": "max", "maximum": "max",
+    "highest": "max", "most": "max", "top": "max", "min": "min", "minimum": "min", "lowest": "min",
+    "least": "min", "bottom": "min", "distinct": "distinct", "unique": "distinct",
+}
+
+# Words that change the answer without naming a schema object: ordering,
+# time grain, ranking direction and negation must match for SQL to be reused.
+MODIFIERS = {
+    "asc": "order:asc", "ascending": "order:asc", "increasing": "order:asc",
+    "desc": "order:desc", "descending": "order:desc", "decreasing": "order:desc",
+    "hourly": "grain:hour", "hour": "grain:hour", "daily": "grain:day", "day": "grain:day",
+    "weekly": "grain:week", "week": "grain:week", "monthly": "grain:month", "month": "grain:month",
+    "quarterly": "grain:quarter", "quarter": "grain:quarter", "yearly": "grain:year", "annual": "grain:year",
+    "year": "grain:year", "top": "rank:top", "first": "rank:top", "bottom": "rank:bottom", "last": "rank:bottom",
+    "not": "neg", "no": "neg", "without": "neg", "excluding": "neg", "exclude": "neg", "except": "neg",
+    "non": "neg", "other": "neg",
+}
+
+STOPWORDS = {
+    "a", "an", "the", "by", "each", "every", "per", "of", "for", "to", "in", "on", "and", "with", "along",
+    "all", "how", "much", "many", "did", "do", "does", "what", "is", "are", "was", "me", "show", "give",
+    "list", "provide", "get", "find", "please", "their", "his", "her", "its", "from", "up",
+}
+
+
+def _stem(token: str) -> str:
+    return token[:-1] if len(token) > 3 and token.endswith("s") and not token.endswith("ss") else token
+
+
+def normalize(prompt: str) -> str:
+    return " ".join(prompt.lower().split())
+
+
+def extract_literals(prompt: str) -> tuple:
+    # Values that change the answer: "from 2025-05-15" and "from 2025-05-20"
+    # are near-identical strings but must never share SQL.
+    quoted = [a or b for a, b in _QUOTED.findall(prompt)]
+    rest = _QUOTED.sub(" ", prompt)
+    dates = _DATES.findall(rest)
+    numbers = _NUMBERS.findall(_DATES.sub(" ", rest))
+    capitalised = re.findall(r"(?<![.!?]\s)(?<!^)\b[A-Z][a-z]+\b", rest)
+    return tuple(sorted(quoted)), tuple(sorted(dates)), tuple(sorted(numbers)), tuple(sorted(capitalised))
+
+
+def _ngrams(text: str, sizes=(3, 4)) -> Counter:
+    # Content words only, stemmed, mapped through SYNONYMS and sorted, so
+    # "sales totals per employee" and "total sales by each employee" match
+    # regardless of word order.
+    text = _DATES.sub("#", text)
+    text = _NUMBERS.sub("#", text)
+    words = sorted(SYNONYMS.get(_stem(w), _stem(w)) for w in _TOKENS.findall(text) if w not in STOPWORDS)
+    words += re.findall(r"#", text)
+    padded = " " + " ".join(words) + " "
+    grams = Counter()
+    for n in sizes:
+        for i in range(len(padded) - n + 1):
+            grams[padded[i:i + n]] += 1
+    return grams
+
+
+class SchemaVocabulary:
+    def __init__(self, schema_columns: dict):
+        self.tables = set(schema_columns)
+        self.columns = {c for cols in schema_columns.values() for c in cols}
+        # stemmed word -> schema objects it may refer to
+        self.terms = {}
+        for table, cols in schema_columns.items():
+            self.terms.setdefault(_stem(table), set()).add(table)
+            for col in cols:
+                for part in col.split("_"):
+                    self.terms.setdefault(_stem(part), set()).add(col)
+
+    def prompt_terms(self, prompt: str) -> frozenset:
+        # Schema words plus the aggregates asked for ("agg:sum", "agg:avg", ...)
+        # and the MODIFIERS ("order:desc", "grain:week", ...).
+        words = [_stem(w) for w in _TOKENS.findall(prompt.lower())]
+        terms = {t for t in (SYNONYMS.get(w, w) for w in words) if t in self.terms}
+        terms.update(f"agg:{AGGREGATES[w]}" for w in words if w in AGGREGATES)
+        terms.update(MODIFIERS[w] for w in words if w in MODIFIERS)
+        return frozenset(terms)
+
+    def required_objects(self, terms) -> set:
+        # Only terms that name exactly one table or column are binding.
+        return {next(iter(self.terms[t])) for t in terms if len(self.terms.get(t, ())) == 1}
+
+
+class _Entry:
+    __slots__ = ("prompt", "sql", "grams", "literals", "terms")
+
+    def __init__(self, prompt, sql, grams, literals, terms):
+        self.prompt = prompt
+        self.sql = sql
+        self.grams = grams
+        self.literals = literals
+        self.terms = terms
+
+
+class SemanticSQLCache:
+    # Character n-gram TF-IDF over past prompts. Entries are indexed by their
+    # binding terms and literals, which _verify requires to match exactly, so
+    # a lookup only scores the few entries that could be reused.
+    def __init__(self, schema_columns: dict, threshold: float = 0.8, max_entries: int = 5000, store=None,
+                 sync_interval: float = 1.0):
+        self.vocabulary = SchemaVocabulary(schema_columns)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.store = store
+        self.sync_interval = sync_interval
+        self._entries = OrderedDict()
+        self._index = {}
+        self._df = Counter()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._seq = 0
+        self._synced = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, prompt: str):
+        # Returns (sql, score, matched_prompt) or None.
+        self._sync()
+        key = normalize(prompt)
+        literals = extract_literals(prompt)
+        terms = self.vocabulary.prompt_terms(prompt)
+        grams = _ngrams(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry.sql, 1.0, entry.prompt
+            candidates = self._index.get((literals, terms), ())
+            scored = sorted(((self._cosine(grams, self._entries[c].grams), c) for c in candidates), reverse=True)
+
+        for score, candidate in scored:
+            if score < self.threshold:
+                break
+            entry = self._entries.get(candidate)
+            if entry is not None and self._verify(entry, literals, terms):
+                with self._lock:
+                    if candidate in self._entries:
+                        self._entries.move_to_end(candidate)
+                return entry.sql, score, entry.prompt
+        return None
+
+    def add(self, prompt: str, sql: str, share: bool = True):
+        key = normalize(prompt)
+        if share and self.store is not None:
+            try:
+                self.store.put("sql", shared_key(key), json.dumps([prompt, sql]).encode("utf-8"))
+            except sqlite3.Error as e:
+                logger.warning(f"Shared SQL cache write failed: {e}")
+        entry = _Entry(prompt, sql, _ngrams(key), extract_literals(prompt), self.vocabulary.prompt_terms(prompt))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._index.setdefault((entry.literals, entry.terms), set()).add(key)
+            for gram in entry.grams:
+                self._df[gram] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _sync(self):
+        # Index pairs other workers added since the last sync (at most every sync_interval).
+        if self.store is None or time.monotonic() - self._synced < self.sync_interval:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._synced = time.monotonic()
+            for seq, blob in self.store.since("sql", self._seq):
+                prompt, sql = json.loads(blob)
+                self.add(prompt, sql, share=False)
+                self._seq = seq
+        except sqlite3.Error as e:
+            logger.warning(f"Shared SQL cache sync failed: {e}")
+        finally:
+            self._sync_lock.release()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+            self._df.clear()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        signature = (entry.literals, entry.terms)
+        keys = self._index.get(signature)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._index[signature]
+        for gram in entry.grams:
+            self._df[gram] -= 1
+            if self._df[gram] <= 0:
+                del self._df[gram]
+
+    def _idf(self, gram):
+        return math.log((1 + len(self._entries)) / (1 + self._df.get(gram, 0))) + 1
+
+    def _cosine(self, a: Counter, b: Counter) -> float:
+        dot = sum(count * b[g] * self._idf(g) ** 2 for g, count in a.items() if g in b)
+        if not dot:
+            return 0.0
+        norm_a = math.sqrt(sum((c * self._idf(g)) ** 2 for g, c in a.items()))
+        norm_b = math.sqrt(sum((c * self._idf(g)) ** 2 for g, c in b.items()))
+        return dot / (norm_a * norm_b)
+
+    def _verify(self, entry: _Entry, literals: tuple, terms: frozenset) -> bool:
+        if entry.literals != literals or entry.terms != terms:
+            return False
+        # The cached SQL must actually touch every table/column the new prompt names.
+        referenced = (referenced_tables(entry.sql, self.vocabulary.tables)
+                      | referenced_columns(entry.sql, self.vocabulary.columns))
+        return self.vocabulary.required_objects(terms) <= referenced
+
+
+def init_sql_cache(config: dict, schema_columns: dict):
+    global SQL_CACHE
+    if not config.get("SEMANTIC_CACHE_ENABLED", True):
+        return
+    SQL_CACHE = SemanticSQLCache(
+        schema_columns,
+        threshold=float(config.get("SEMANTIC_CACHE_THRESHOLD", 0.8)),
+        max_entries=int(config.get("SEMANTIC_CACHE_MAX_ENTRIES", 5000)),
+        store=shared_cache.SHARED_STORE,
+        sync_interval=float(config.get("SHARED_CACHE_SYNC_SECONDS", 1.0)),
+    )
+    logger.info(f"Semantic SQL cache enabled (threshold {SQL_CACHE.threshold}).")
+
+def cached_sql(prompt: str):
+    if SQL_CACHE is None:
+        return None
+    hit = SQL_CACHE.lookup(prompt)
+    if hit and hit[1] < 1.0:
+        logger.info(f"Semantic cache reused SQL of {hit[2]!r} for {prompt!r} (score {hit[1]:.2f})")
+    return hit[0] if hit else None
+
+def remember_sql(prompt: str, sql: str):
+    if SQL_CACHE is not None:
+        SQL_CACHE.add(prompt, sql)
@@ -0,0 +1,308 @@
+from app import metrics
+from app.utils import private_dir
+from collections import OrderedDict
+from decimal import Decimal
+from pathlib import Path
+from uuid import UUID
+import threading
+import datetime
+import logging
+import hashlib
+import sqlite3
+import base64
+import json
+import time
+import os
+
+logger = logging.getLogger(__name__)
+SHARED_STORE = None
+RESULT_CACHE = None
+DEFAULT_PATH = Path(__file__).parent.parent / "cache" / "shared.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE INDEX IF NOT EXISTS entries_seq ON entries (namespace, seq);
+CREATE TABLE IF NOT EXISTS counter (id INTEGER PRIMARY KEY CHECK (id = 1), seq INTEGER NOT NULL);
+INSERT OR IGNORE INTO counter (id, seq) VALUES (1, 0);
+"""
+
+
+class SQLiteStore:
+    # One SQLite file shared by every worker process on the host. WAL mode
+    # lets readers run while one writer commits; byte accounting and LRU
+    # eviction happen inside the writer's transaction, so max_bytes holds
+    # across processes. Connections are per thread and per process (opened
+    # after a fork, never inherited).
+    def __init__(self, path, max_bytes: int, max_entry_bytes: int, touch_interval: float = 5.0):
+        self.path = Path(path)
+        private_dir(self.path.parent)
+        os.close(os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600))
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, namespace: str, key: str):
+        conn = self._conn()
+        row = conn.execute("SELECT value, accessed FROM entries WHERE namespace = ? AND key = ?",
+                           (namespace, key)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        # Recency only needs to be roughly right; skipping most touches keeps reads off the write lock.
+        if now - row[1] > self.touch_interval:
+            conn.execute("UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?", (now, namespace, key))
+        return row[0]
+
+    def put(self, namespace: str, key: str, value: bytes) -> bool:
+        if len(value) > self.max_entry_bytes:
+            return False
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # A counter that never goes back, so since() can't miss an entry when the newest one is evicted.
+            conn.execute("UPDATE counter SET seq = seq + 1 WHERE id = 1")
+            seq = conn.execute("SELECT seq FROM counter WHERE id = 1").fetchone()[0]
+            conn.execute(
+                "INSERT INTO entries (namespace, key, value, size, accessed, seq) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+                "accessed = excluded.accessed, seq = excluded.seq",
+                (namespace, key, value, len(value), time.time(), seq))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            evicted = 0
+            while total > self.max_bytes:
+                victims = conn.execute("SELECT namespace, key, size FROM entries ORDER BY accessed LIMIT 64").fetchall()
+                if not victims:
+                    break
+                for victim_ns, victim_key, size in victims:
+                    conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (victim_ns, victim_key))
+                    total -= size
+                    evicted += 1
+                    if total <= self.max_bytes:
+                        break
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if evicted:
+            metrics.SHARED_CACHE_EVICTIONS.inc(evicted)
+        return True
+
+    def delete(self, namespace: str, key: str):
+        self._conn().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def clear(self, namespace: str):
+        self._conn().execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+
+    def since(self, namespace: str, seq: int, limit: int = 1000) -> list:
+        # Entries written (by any worker) after seq, oldest first: [(seq, value)].
+        return self._conn().execute("SELECT seq, value FROM entries WHERE namespace = ? AND seq > ? "
+                                    "ORDER BY seq LIMIT ?", (namespace, seq, limit)).fetchall()
+
+    def size(self) -> int:
+        return self._conn().execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+
+def shared_key(key) -> str:
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+
+# Shared values are JSON, never pickle, so reading the store can't run code.
+# Types JSON lacks (and tuples, and dicts with non-string keys) are tagged.
+_DECODERS = {
+    "tuple": tuple,
+    "dict": lambda pairs: {k: v for k, v in pairs},
+    "decimal": Decimal,
+    "datetime": datetime.datetime.fromisoformat,
+    "date": datetime.date.fromisoformat,
+    "time": datetime.time.fromisoformat,
+    "timedelta": lambda v: datetime.timedelta(*v),
+    "uuid": UUID,
+    "bytes": base64.b64decode,
+}
+
+
+def _tag(value):
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, list):
+        return [_tag(v) for v in value]
+    if isinstance(value, tuple):
+        return {"$t": "tuple", "v": [_tag(v) for v in value]}
+    if isinstance(value, dict):
+        if "$t" not in value and all(isinstance(k, str) for k in value):
+            return {k: _tag(v) for k, v in value.items()}
+        return {"$t": "dict", "v": [[_tag(k), _tag(v)] for k, v in value.items()]}
+    if isinstance(value, Decimal):
+        return {"$t": "decimal", "v": str(value)}
+    if isinstance(value, datetime.datetime):
+        return {"$t": "datetime", "v": value.isoformat()}
+    if isinstance(value, (datetime.date, datetime.time)):
+        return {"$t": type(value).__name__, "v": value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        return {"$t": "timedelta", "v": [value.days, value.seconds, value.microseconds]}
+    if isinstance(value, UUID):
+        return {"$t": "uuid", "v": str(value)}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"$t": "bytes", "v": base64.b64encode(bytes(value)).decode("ascii")}
+    raise TypeError(f"{type(value).__name__} values can't be shared")
+
+
+def _untag(obj: dict):
+    if "$t" in obj and obj.keys() == {"$t", "v"}:
+        return _DECODERS[obj["$t"]](obj["v"])
+    return obj
+
+
+def dumps(value) -> bytes:
+    return json.dumps(_tag(value), separators=(",", ":")).encode("utf-8")
+
+
+def loads(blob: bytes):
+    return json.loads(blob, object_hook=_untag)
+
+
+class TieredCache:
+    # In-process LRU in front of the shared store. A local miss falls through
+    # to the store and promotes what it finds; puts write through. encode and
+    # decode turn values into bytes and back (tagged JSON by default); the
+    # local tier keeps them as objects. With sizeof, the local tier also holds
+    # at most max_bytes and skips values over max_entry_bytes.
+    def __init__(self, namespace: str, max_entries: int, store: SQLiteStore = None, encode=dumps, decode=loads,
+                 sizeof=None, max_bytes: int = 0, max_entry_bytes: int = 0):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.store = store
+        self.encode = encode
+        self.decode = decode
+        self.sizeof = sizeof
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.bytes = 0
+        # key -> (value, size)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                self._entries.move_to_end(key)
+                return item[0]
+        if self.store is None:
+            return None
+        try:
+            blob = self.store.get(self.namespace, shared_key(key))
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache read failed ({self.namespace}): {e}")
+            return None
+        metrics.cache_lookup(f"shared_{self.namespace}", blob is not None)
+        if blob is None:
+            return None
+        try:
+            value = self.decode(blob)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Dropping unreadable shared cache entry ({self.namespace}): {e}")
+            self.store.delete(self.namespace, shared_key(key))
+            return None
+        self._put_local(key, value)
+        return value
+
+    def put(self, key, value):
+        self._put_local(key, value)
+        if self.store is not None:
+            try:
+                self.store.put(self.namespace, shared_key(key), self.encode(value))
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                logger.warning(f"Shared cache write failed ({self.namespace}): {e}")
+
+    def drop(self, key):
+        with self._lock:
+            self._pop_local(key)
+        if self.store is not None:
+            self.store.delete(self.namespace, shared_key(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+        if self.store is not None:
+            self.store.clear(self.namespace)
+
+    def _put_local(self, key, value):
+        size = self.sizeof(value) if self.sizeof else 0
+        with self._lock:
+            self._pop_local(key)
+            if self.max_entry_bytes and size > self.max_entry_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def _pop_local(self, key):
+        # Caller holds the lock.
+        item = self._entries.pop(key, None)
+        if item is not None:
+            self.bytes -= item[1]
+
+
+def _encode_result(result) -> bytes:
+    # Response metadata as one JSON line, then the body as is.
+    body, media_type, headers = result
+    return json.dumps({"media_type": media_type, "headers": headers}).encode("utf-8") + b"\n" + body
+
+def _decode_result(blob: bytes):
+    meta, _, body = bytes(blob).partition(b"\n")
+    meta = json.loads(meta)
+    return body, meta["media_type"], meta["headers"]
+
+def cached_result(etag: str):
+    # (body, media_type, headers) of a response with this ETag, from any worker.
+    return RESULT_CACHE.get(etag) if RESULT_CACHE is not None else None
+
+def remember_result(etag: str, body: bytes, media_type: str, headers: dict):
+    if RESULT_CACHE is not None:
+        RESULT_CACHE.put(etag, (body, media_type, headers))
+
+
+def init_shared_cache(config: dict):
+    global SHARED_STORE, RESULT_CACHE
+    backend = config.get("SHARED_CACHE_BACKEND", "none")
+    if backend == "sqlite":
+        SHARED_STORE = SQLiteStore(
+            config.get("SHARED_CACHE_PATH") or DEFAULT_PATH,
+            max_bytes=int(config.get("SHARED_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+            max_entry_bytes=int(config.get("SHARED_CACHE_MAX_ENTRY_BYTES", 8 * 1024 * 1024)),
+        )
+        logger.info(f"Shared cache at {SHARED_STORE.path} ({SHARED_STORE.max_bytes} bytes).")
+    elif backend != "none":
+        raise ValueError(f"Unknown SHARED_CACHE_BACKEND: {backend}")
+    if config.get("RESULT_CACHE_ENABLED", True):
+        # Bodies too big for the shared store aren't kept locally either, so the
+        # local tier stays within RESULT_CACHE_LOCAL_MAX_BYTES per worker.
+        RESULT_CACHE = TieredCache("results", int(config.get("RESULT_CACHE_LOCAL_ENTRIES", 64)), SHARED_STORE,
+                                   encode=_encode_result, decode=_decode_result, sizeof=lambda result: len(result[0]),
+                                   max_bytes=int(config.get("RESULT_CACHE_LOCAL_MAX_BYTES", 32 * 1024 * 1024)),
+                                   max_entry_bytes=int(config.get("SHARED_CACHE_MAX_ENTRY_BYTES", 8 * 1024 * 1024)))
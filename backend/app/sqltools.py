@@ -0,0 +1,154 @@
+from functools import lru_cache
+import re
+
+
+@lru_cache(maxsize=256)
+def _word(name: str):
+    return re.compile(rf"\b{re.escape(name)}\b", re.I)
+
+
+def referenced_tables(sql: str, known_tables) -> set:
+    # Generated SQL only ever touches the tables described in schemas/, so
+    # matching those names as whole words is enough (and errs on the side of
+    # listing a table that's merely mentioned, which only over-invalidates).
+    return {t for t in known_tables if _word(t).search(sql or "")}
+
+
+def referenced_columns(sql: str, known_columns) -> set:
+    return {c for c in known_columns if _word(c).search(sql or "")}
+
+
+def _ident_char(ch: str) -> bool:
+    return ch.isalnum() or ch in "_$" or ord(ch) > 127
+
+
+def _literal_end(sql: str, i: int) -> int:
+    # Index just past the quoted literal or identifier starting at sql[i],
+    # or -1 when it is never closed. E'...' strings (an E that starts a
+    # token, as PostgreSQL lexes it) take backslash escapes, so \' doesn't
+    # end them; '' and "" are read as two adjacent literals, which ends in
+    # the same place.
+    quote = sql[i]
+    escapes = (quote == "'" and i > 0 and sql[i - 1] in "eE"
+               and (i == 1 or not _ident_char(sql[i - 2])))
+    j, n = i + 1, len(sql)
+    while j < n:
+        if escapes and sql[j] == "\\":
+            j += 2
+            continue
+        if sql[j] == quote:
+            return j + 1
+        j += 1
+    return -1
+
+
+def single_statement(sql: str) -> bool:
+    # False when a ";" outside literals, quoted identifiers and comments is
+    # followed by anything but whitespace, i.e. the text holds a second
+    # statement. Dollar quoting is refused outright rather than parsed.
+    # Assumes standard_conforming_strings (the default, and forced on the
+    # pools in database.py), under which only E'' strings take backslashes.
+    i, n = 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if ch in ("'", '"'):
+            end = _literal_end(sql, i)
+            if end < 0:
+                return True
+            i = end
+            continue
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            if end < 0:
+                return True
+            i = end + 1
+            continue
+        if sql.startswith("/*", i):
+            depth, i = 1, i + 2
+            while i < n and depth:
+                if sql.startswith("/*", i):
+                    depth, i = depth + 1, i + 2
+                elif sql.startswith("*/", i):
+                    depth, i = depth - 1, i + 2
+                else:
+                    i += 1
+            continue
+        if ch == "$":
+            return False
+        if ch == ";":
+            return not sql[i + 1:].strip(" \t\r\n;")
+        i += 1
+    return True
+
+
+def is_single_select(sql: str) -> bool:
+    return sql.lstrip().lower().startswith("select") and single_statement(sql)
+
+
+def mask_nested(sql: str) -> str:
+    # Same length as sql, with string literals, quoted identifiers and
+    # anything inside parentheses blanked out, so regexes only see the
+    # top level of the statement.
+    out = []
+    depth = 0
+    quote = None
+    for ch in sql:
+        if quote:
+            out.append(" ")
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+            out.append(" ")
+        elif ch == "(":
+            depth += 1
+            out.append("(" if depth == 1 else " ")
+        elif ch == ")":
+            depth -= 1
+            out.append(")" if depth == 0 else " ")
+        else:
+            out.append(ch if depth == 0 else " ")
+    return "".join(out)
+
+
+def split_top_level(text: str, sep: str = ",") -> list:
+    masked = mask_nested(text)
+    parts, start = [], 0
+    for i, ch in enumerate(masked):
+        if ch == sep:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [p.strip() for p in parts]
+
+
+def top_level_clause(sql: str, keyword: str, next_keywords=()):
+    # Text of e.g. the ORDER BY clause at the top level, or None.
+    masked = mask_nested(sql).lower()
+    match = re.search(rf"\b{keyword}\b", masked)
+    if not match:
+        return None
+    end = len(sql)
+    for nxt in next_keywords:
+        found = re.search(rf"\b{nxt}\b", masked[match.end():])
+        if found:
+            end = min(end, match.end() + found.start())
+    return sql[match.end():end].strip()
+
+
+def select_list_span(sql: str):
+    # (start, end) of the top-level SELECT list, or None for SELECT DISTINCT
+    # and anything that isn't a plain SELECT ... FROM.
+    masked = mask_nested(sql).lower()
+    start = re.match(r"\s*select\s+", masked)
+    end = re.search(r"\bfrom\b", masked)
+    if not start or not end or re.match(r"distinct\b", masked[start.end():]):
+        return None
+    return start.end(), end.start()
+
+
+def select_items(sql: str):
+    span = select_list_span(sql)
+    if span is None:
+        return None
+    return split_top_level(sql[span[0]:span[1]])
@@ -0,0 +1,248 @@
+from app.metrics import TEMPLATE_MATCHES, cache_lookup
+from app.querylog import BACKEND_DIR, read_entries
+from collections import Counter, defaultdict
+from datetime import datetime
+import argparse
+import logging
+import json
+import re
+
+logger = logging.getLogger(__name__)
+TEMPLATES = None
+
+_DATE = r"\d{4}-\d{2}-\d{2}"
+_SLOT = re.compile(r"\{([a-z_]\w*)\}")
+_SLOT_PATTERNS = {
+    "date": lambda name: rf"(?P<{name}>{_DATE})",
+    "int": lambda name: rf"(?P<{name}>\d{{1,6}})",
+    # Names of employees, items, ...: no quotes or punctuation beyond an apostrophe or hyphen.
+    "text": lambda name: rf"(?P<{name}>[a-z0-9][\w'\- ]{{0,60}}?)",
+    # The suffix frontend/data.py appends: " from A to B", " from A", " up to B".
+    "date_range": lambda name: (rf"(?:\s+from\s+(?P<{name}__start>{_DATE}))?"
+                                rf"(?:\s+(?:to|until|up\s+to)\s+(?P<{name}__end>{_DATE}))?"),
+}
+
+
+def normalize(prompt: str) -> str:
+    return " ".join(prompt.split()).rstrip(".?!").strip()
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _valid_date(value: str) -> bool:
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+        return True
+    except ValueError:
+        return False
+
+
+class Template:
+    # patterns are regexes over the whitespace-normalized prompt in which
+    # {slot} stands for a typed capture; sql uses the same {slot} names for
+    # the bound SQL literals.
+    def __init__(self, name: str, patterns: list, sql: str, slots: dict = None):
+        self.name = name
+        self.sql = sql
+        self.slots = slots or {}
+        for slot in set(_SLOT.findall(sql)) | {s for p in patterns for s in _SLOT.findall(p)}:
+            if slot not in self.slots:
+                raise ValueError(f"Template {name}: slot {{{slot}}} has no type")
+        self.patterns = [re.compile(self._expand(p), re.I) for p in patterns]
+
+    def _expand(self, pattern: str) -> str:
+        return _SLOT.sub(lambda m: _SLOT_PATTERNS[self.slots[m.group(1)]["type"]](m.group(1)), pattern)
+
+    @classmethod
+    def from_dict(cls, spec: dict):
+        return cls(spec["name"], spec["patterns"], spec["sql"], spec.get("slots"))
+
+    def match(self, prompt: str):
+        # SQL for the prompt, or None when no pattern matches or a value is out of range.
+        text = normalize(prompt)
+        for pattern in self.patterns:
+            match = pattern.fullmatch(text)
+            if match:
+                values = self._bind(match.groupdict())
+                if values is not None:
+                    return _SLOT.sub(lambda m: values[m.group(1)], self.sql)
+        return None
+
+    def _bind(self, groups: dict):
+        values = {}
+        for name, spec in self.slots.items():
+            kind = spec["type"]
+            if kind == "date_range":
+                start, end = groups.get(f"{name}__start"), groups.get(f"{name}__end")
+                if any(d and not _valid_date(d) for d in (start, end)):
+                    return None
+                column = spec["column"]
+                conditions = ([f"{column} >= {_quote(start)}"] if start else []) + \
+                             ([f"{column} < {_quote(end)}::date + 1"] if end else [])
+                values[name] = " AND ".join(conditions) or "TRUE"
+                continue
+            value = groups.get(name)
+            if value is None:
+                if "default" not in spec:
+                    return None
+                value = str(spec["default"])
+            if kind == "date" and not _valid_date(value):
+                return None
+            if kind == "int":
+                if not 0 < int(value) <= int(spec.get("max", 1000)):
+                    return None
+                values[name] = str(int(value))
+            else:
+                values[name] = _quote(value.strip())
+        return values
+
+
+class TemplateLibrary:
+    def __init__(self, templates: list):
+        self.templates = templates
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            specs = json.load(f)
+        return cls([Template.from_dict(spec) for spec in specs])
+
+    def __len__(self):
+        return len(self.templates)
+
+    def match(self, prompt: str):
+        # (template name, sql) of the first template matching, or None.
+        for template in self.templates:
+            sql = template.match(prompt)
+            if sql is not None:
+                return template.name, sql
+        return None
+
+
+def init_templates(config: dict):
+    global TEMPLATES
+    if not config.get("TEMPLATES_ENABLED", True):
+        return
+    path = BACKEND_DIR / config.get("TEMPLATES_PATH", "templates.json")
+    if not path.exists():
+        logger.info(f"No template library at {path}; every prompt goes to the LLM.")
+        return
+    TEMPLATES = TemplateLibrary.from_file(path)
+    logger.info(f"Loaded {len(TEMPLATES)} SQL templates from {path}")
+
+def template_sql(prompt: str):
+    if TEMPLATES is None:
+        return None
+    hit = TEMPLATES.match(prompt)
+    cache_lookup("template", hit is not None)
+    if hit is None:
+        return None
+    TEMPLATE_MATCHES.inc(template=hit[0])
+    logger.info(f"Template {hit[0]} matched {prompt!r}")
+    return hit[1]
+
+
+def _draft(name: str, prompt: str, sql: str):
+    # Turns one logged (prompt, sql) pair into a template by making every
+    # literal that appears in both into a slot. Returns None when nothing
+    # varies or a prompt literal can't be traced into the SQL.
+    text = normalize(prompt)
+    spans, slots, template_sql = [], {}, sql
+    for match in re.finditer(rf"{_DATE}|\b\d+\b", text):
+        value = match.group(0)
+        kind = "date" if re.fullmatch(_DATE, value) else "int"
+        literal = _quote(value) if kind == "date" else value
+        occurrence = re.search(rf"(?<![\w.']){re.escape(literal)}(?![\w.'])", template_sql)
+        if occurrence is None:
+            return None
+        slot = f"{kind}{len(slots) + 1}"
+        slots[slot] = {"type": kind}
+        spans.append((match.start(), match.end(), slot))
+        template_sql = template_sql[:occurrence.start()] + "{" + slot + "}" + template_sql[occurrence.end():]
+    for literal in re.findall(r"'((?:[^']|'')*)'", template_sql):
+        value = literal.replace("''", "'")
+        found = re.search(rf"\b{re.escape(value)}\b", text, re.I) if value and not re.fullmatch(_DATE, value) else None
+        if found and not any(s < found.end() and found.start() < e for s, e, _ in spans):
+            slot = f"text{len(slots) + 1}"
+            slots[slot] = {"type": "text"}
+            spans.append((found.start(), found.end(), slot))
+            template_sql = template_sql.replace(f"'{literal}'", "{" + slot + "}", 1)
+    if not slots:
+        return None
+
+    pattern, pos = [], 0
+    for start, end, slot in sorted(spans):
+        pattern.append(re.escape(text[pos:start]).replace(r"\ ", r"\s+"))
+        pattern.append("{" + slot + "}")
+        pos = end
+    pattern.append(re.escape(text[pos:]).replace(r"\ ", r"\s+"))
+    return {"name": name, "patterns": ["".join(pattern)], "sql": template_sql, "slots": slots}
+
+
+def suggest(entries, min_count: int = 5, min_precision: float = 0.95):
+    # Draft templates for frequent fingerprints in the query log. Each draft
+    # is replayed against every logged prompt of its fingerprint and kept
+    # only if the SQL it renders is what the LLM actually produced.
+    groups = defaultdict(list)
+    for entry in entries:
+        if entry.get("error") or not entry.get("prompt") or not entry.get("sql"):
+            continue
+        groups[entry["fingerprint"]].append((entry["prompt"], entry["sql"]))
+
+    suggestions = []
+    for fp, pairs in groups.items():
+        if len(pairs) < min_count:
+            continue
+        prompt = Counter(p for p, _ in pairs).most_common(1)[0][0]
+        spec = _draft(f"log_{fp}", prompt, next(s for p, s in pairs if p == prompt))
+        if spec is None:
+            continue
+        template = Template.from_dict(spec)
+        matched = correct = 0
+        for logged_prompt, logged_sql in pairs:
+            rendered = template.match(logged_prompt)
+            if rendered is not None:
+                matched += 1
+                correct += " ".join(rendered.split()) == " ".join(logged_sql.split())
+        if matched and correct / matched >= min_precision:
+            spec["stats"] = {"logged": len(pairs), "matched": matched, "correct": correct}
+            suggestions.append(spec)
+    suggestions.sort(key=lambda s: s["stats"]["matched"], reverse=True)
+    return suggestions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed the NL-to-SQL template library from the query log.")
+    parser.add_argument("--log", default=str(BACKEND_DIR / "logs" / "queries.jsonl"))
+    parser.add_argument("--templates", default=str(BACKEND_DIR / "templates.json"))
+    parser.add_argument("--min-count", type=int, default=5, help="only fingerprints logged at least this often")
+    parser.add_argument("--write", action="store_true", help="append new suggestions to the template library")
+    parser.add_argument("--match", metavar="PROMPT", help="show which template (if any) answers PROMPT")
+    args = parser.parse_args()
+
+    if args.match:
+        hit = TemplateLibrary.from_file(args.templates).match(args.match)
+        print(f"{hit[0]}: {hit[1]}" if hit else "no template matches")
+        return
+
+    suggestions = suggest(read_entries(args.log), args.min_count)
+    if not args.write:
+        print(json.dumps(suggestions, indent=2))
+        return
+    try:
+        with open(args.templates) as f:
+            library = json.load(f)
+    except FileNotFoundError:
+        library = []
+    known = {spec["name"] for spec in library}
+    added = [s for s in suggestions if s["name"] not in known]
+    with open(args.templates, "w") as f:
+        json.dump(library + added, f, indent=2)
+        f.write("\n")
+    print(f"Added {len(added)} templates to {args.templates}; review them before deploying.")
+
+
+if __name__ == "__main__":
+    main()
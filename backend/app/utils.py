@@ -1,10 +1,37 @@
 from pathlib import Path
+from functools import lru_cache
 import logging
+import json
+import os
+import re
 from pydantic import BaseModel
+from typing import Dict, Optional
 
 logger = logging.getLogger(__name__)
 SCHEMA_DIR = Path(__file__).parent.parent / "schemas"
 
+@lru_cache(maxsize=8)
+def _parse_config(path: str, mtime_ns: int) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+def load_config(path) -> dict:
+    # Parsed once per file version and process. Workers only share the parse
+    # when forked after it (gunicorn --preload); otherwise each parses its own.
+    path = Path(path)
+    return _parse_config(str(path), path.stat().st_mtime_ns)
+
+def private_dir(path) -> Path:
+    # Creates path as a 0700 directory, or checks that an existing one belongs
+    # to this user and nobody else can write to it; cache and spill files in it
+    # are trusted when read back, so nobody else may plant or swap them.
+    path = Path(path)
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    info = os.lstat(path)
+    if path.is_symlink() or (hasattr(os, "getuid") and info.st_uid != os.getuid()) or info.st_mode & 0o022:
+        raise PermissionError(f"{path} must be a directory owned by this user and writable by no one else.")
+    return path
+
 def load_all_schema_contexts() -> str:
     schema_files = SCHEMA_DIR.glob("*.txt")
     contexts = []
@@ -17,5 +44,34 @@ def load_all_schema_contexts() -> str:
     logger.info(f"Loaded {len(contexts)} schema files.")
     return "\n\n".join(contexts)
 
+def load_schema_columns() -> dict:
+    # {"sales": ["id", "item_name", ...], ...} from the "Table:" and "- column TYPE" lines.
+    tables = {}
+    for file in SCHEMA_DIR.glob("*.txt"):
+        current = None
+        for line in file.read_text(encoding="utf-8").splitlines():
+            table = re.match(r"^Table:\s*(\w+)", line)
+            column = re.match(r"^-\s*(\w+)\s", line)
+            if table:
+                current = tables.setdefault(table.group(1), [])
+            elif column and current is not None:
+                current.append(column.group(1))
+    return tables
+
 class QueryRequest(BaseModel):
-    query: str
\ No newline at end of file
+    query: str
+    # Serve aggregates from the watermark cache, scanning only new sales rows.
+    incremental: bool = False
+    # With incremental: return only the groups that changed since the last refresh.
+    delta: bool = False
+    # Estimate SUM/COUNT/AVG from a TABLESAMPLE of large tables, with *_margin columns.
+    approximate: bool = False
+    # Columnar {"columns", "data"} body with column types, NUMERIC as float, timestamps as ISO text.
+    typed: bool = False
+
+class BatchPanel(BaseModel):
+    query: Optional[str] = None
+    sql: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    panels: Dict[str, BatchPanel]
\ No newline at end of file
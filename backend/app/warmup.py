@@ -0,0 +1,114 @@
+from app import querylog
+from app import metrics
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+WARMER = None
+
+
+class Warmer:
+    # Replays popular prompts so the first users after a restart hit warm SQL,
+    # result and database caches. Readiness is reported once the first pass is
+    # done (or its time budget runs out); after that the same prompts are
+    # replayed whenever a scheduled check finds the tables changed.
+    def __init__(self, replay, versions, prompts=(), top_n: int = 10, history_hours: float = 24,
+                 log_path=None, timeout: float = 120, interval: float = 300):
+        self.replay = replay
+        self.versions = versions
+        self.prompts = list(prompts)
+        self.top_n = top_n
+        self.history_hours = history_hours
+        self.log_path = log_path
+        self.timeout = timeout
+        self.interval = interval
+        self.ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    def popular_prompts(self) -> list:
+        # Configured prompts first, then the most frequent ones from the query log.
+        prompts = list(self.prompts)
+        if self.top_n and self.log_path is not None and self.log_path.exists():
+            since = time.time() - self.history_hours * 3600 if self.history_hours else 0
+            for group in querylog.top(self.log_path, by="count", limit=self.top_n, since=since):
+                if group["errors"] < group["count"] and group["top_prompt"]:
+                    prompts.append(group["top_prompt"])
+        return list(dict.fromkeys(p.strip() for p in prompts if p and p.strip()))
+
+    def warm(self, deadline: float = None):
+        prompts = self.popular_prompts()
+        start = time.perf_counter()
+        warmed = 0
+        for i, prompt in enumerate(prompts):
+            if self._stop.is_set():
+                return
+            if deadline is not None and time.monotonic() > deadline:
+                logger.warning(f"Warm-up time budget spent; skipping {len(prompts) - i} prompts.")
+                metrics.WARMUP_PROMPTS.inc(len(prompts) - i, result="skipped")
+                break
+            try:
+                self.replay(prompt)
+                warmed += 1
+                metrics.WARMUP_PROMPTS.inc(result="ok")
+            except Exception as e:
+                logger.warning(f"Warm-up failed for {prompt!r}: {e}")
+                metrics.WARMUP_PROMPTS.inc(result="error")
+        logger.info(f"Warmed {warmed}/{len(prompts)} prompts in {time.perf_counter() - start:.1f}s")
+
+    def _current_versions(self):
+        try:
+            return self.versions()
+        except Exception as e:
+            logger.warning(f"Warm-up could not read table versions: {e}")
+            return None
+
+    def _run(self):
+        seen = self._current_versions()
+        try:
+            self.warm(deadline=time.monotonic() + self.timeout if self.timeout else None)
+        finally:
+            self.ready.set()
+        if not self.interval:
+            return
+        while not self._stop.wait(self.interval):
+            # Only after a data load; unchanged tables mean the caches are still valid.
+            current = self._current_versions()
+            if current is not None and current != seen:
+                logger.info("Tables changed since the last warm-up; refreshing popular prompts.")
+                self.warm()
+                seen = current
+
+
+def init_warmup(config: dict, replay, versions):
+    global WARMER
+    if not config.get("WARMUP_ENABLED", True):
+        return
+    WARMER = Warmer(
+        replay,
+        versions,
+        prompts=config.get("WARMUP_PROMPTS", []),
+        top_n=int(config.get("WARMUP_TOP_N", 10)),
+        history_hours=float(config.get("WARMUP_HISTORY_HOURS", 24)),
+        log_path=querylog.BACKEND_DIR / config.get("QUERY_LOG_PATH", "logs/queries.jsonl"),
+        timeout=float(config.get("WARMUP_TIMEOUT_SECONDS", 120)),
+        interval=float(config.get("WARMUP_REFRESH_SECONDS", 300)),
+    )
+    WARMER.start()
+
+def close_warmup():
+    global WARMER
+    if WARMER:
+        WARMER.stop()
+        WARMER = None
+
+def is_ready() -> bool:
+    return WARMER is None or WARMER.ready.is_set()
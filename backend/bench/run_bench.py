@@ -0,0 +1,264 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import requests
+
+from bench.seed import add_db_args, connect_for_seed, seed
+
+logger = logging.getLogger(__name__)
+BACKEND_DIR = Path(__file__).parent.parent
+# Fresh per run; the bench server maps it to its proxy tenant.
+BENCH_API_KEY = secrets.token_urlsafe(16)
+
+# The canonical dashboard prompts from the README, with and without a date range.
+DEFAULT_MIX = {
+    "provide total sales by each employee": 3,
+    "all employee details along with the total products sold by each emaploye": 3,
+    "provide total sales by each employee from 2025-05-15 to 2025-06-01": 1,
+    "all employee details along with the total products sold by each emaploye from 2025-05-20 to 2025-05-25": 1,
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+def parse_server_timing(header):
+    # "llm;dur=812.3, db;dur=4.1" -> {"llm": 812.3, "db": 4.1}
+    stages = {}
+    for part in (header or "").split(","):
+        fields = [f.strip() for f in part.split(";")]
+        if not fields[0]:
+            continue
+        for field in fields[1:]:
+            if field.startswith("dur="):
+                try:
+                    stages[fields[0]] = float(field[4:])
+                except ValueError:
+                    pass
+    return stages
+
+
+def parse_mix(spec):
+    if not spec:
+        return DEFAULT_MIX
+    if os.path.exists(spec):
+        with open(spec) as f:
+            return json.load(f)
+    mix = {}
+    for item in spec.split(";"):
+        prompt, _, weight = item.rpartition("=")
+        mix[prompt.strip()] = float(weight)
+    return mix
+
+
+def start_server(args, config_path):
+    env = dict(os.environ, APP_CONFIG=str(config_path))
+    cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+           "--port", str(args.port), "--workers", str(args.workers), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited with code {proc.returncode}")
+        try:
+            requests.get(f"http://127.0.0.1:{args.port}/docs", timeout=1)
+            return proc
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("Server did not start within 30s")
+
+
+def drive(url, mix, concurrency, total_requests, warmup, seed_value):
+    rng = random.Random(seed_value)
+    prompts = list(mix)
+    weights = [mix[p] for p in prompts]
+    plan = rng.choices(prompts, weights=weights, k=warmup + total_requests)
+
+    local = threading.local()
+    lock = threading.Lock()
+    users = itertools.count(1)
+    stages = defaultdict(list)
+    per_prompt = defaultdict(list)
+    statuses = defaultdict(int)
+
+    def one(i, prompt):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+            # One simulated user per client thread, so per-user quotas don't throttle the whole run.
+            session.headers["X-API-Key"] = BENCH_API_KEY
+            session.headers["X-User"] = f"user-{next(users)}"
+        start = time.perf_counter()
+        try:
+            response = session.post(url, json={"query": prompt}, timeout=120)
+            status = response.status_code
+            timings = parse_server_timing(response.headers.get("Server-Timing"))
+            size = len(response.content)
+        except requests.RequestException:
+            status, timings, size = "error", {}, 0
+        elapsed = (time.perf_counter() - start) * 1000
+        if i < warmup:
+            return
+        with lock:
+            statuses[str(status)] += 1
+            stages["client_total"].append(elapsed)
+            stages["response_bytes"].append(size)
+            per_prompt[prompt].append(elapsed)
+            for name, dur in timings.items():
+                stages[name].append(dur)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda args: one(*args), enumerate(plan[:warmup])))
+        started = time.perf_counter()
+        list(pool.map(lambda args: one(*args), enumerate(plan[warmup:], start=warmup)))
+        wall = time.perf_counter() - started
+
+    return {
+        "wall_seconds": wall,
+        "throughput_rps": total_requests / wall if wall else None,
+        "statuses": dict(statuses),
+        "stages_ms": {name: summarize(v) for name, v in stages.items() if name != "response_bytes"},
+        "response_bytes": summarize(stages["response_bytes"]),
+        "per_prompt_ms": {p: summarize(v) for p, v in per_prompt.items()},
+    }
+
+
+def compare(old, new):
+    lines = [f"throughput_rps: {old.get('throughput_rps'):.2f} -> {new.get('throughput_rps'):.2f}"]
+    for stage, stats in new["stages_ms"].items():
+        before = old.get("stages_ms", {}).get(stage)
+        if not before:
+            continue
+        for key in ("p50", "p95", "p99"):
+            if before[key] and stats[key]:
+                change = (stats[key] - before[key]) / before[key] * 100
+                lines.append(f"{stage} {key}: {before[key]:.1f} -> {stats[key]:.1f} ms ({change:+.1f}%)")
+    return "\n".join(lines)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /api/query end to end against a local Postgres and a stub LLM.")
+    add_db_args(parser)
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument("--employees", type=int, default=1000)
+    parser.add_argument("--sales-per-employee", type=int, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--mix", help='JSON file or "prompt=weight;prompt=weight"')
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--config", help="extra config.json keys to merge into the server config")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="result JSON path (default bench_results/<commit>.json)")
+    parser.add_argument("--compare", help="previous result JSON to diff against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if not args.skip_seed:
+        conn = connect_for_seed(args)
+        try:
+            seed(conn, args.employees, args.sales_per_employee, seed=args.seed)
+        finally:
+            conn.close()
+
+    # The query log and shared cache live in a scratch directory, so synthetic
+    # prompts never reach the log that warm-up and template mining read.
+    scratch = tempfile.TemporaryDirectory(prefix="agent-plot-bench-")
+    server_config = {
+        "DB_HOST": args.db_host, "DB_PORT": args.db_port, "DB_NAME": args.db_name,
+        "DB_USER": args.db_user, "DB_PASSWORD": args.db_password,
+        "LLM_PROVIDER": "stub",
+        "LLM_STUB_LATENCY_MS": args.llm_latency_ms,
+        "LLM_STUB_JITTER_MS": args.llm_jitter_ms,
+        "QUERY_LOG_PATH": str(Path(scratch.name) / "queries.jsonl"),
+        "SHARED_CACHE_PATH": str(Path(scratch.name) / "cache.sqlite"),
+        "RESULT_SPILL_DIR": str(Path(scratch.name) / "spill"),
+        # X-User is only trusted from a proxy tenant, so the clients authenticate as one.
+        "TENANT_API_KEYS": {BENCH_API_KEY: "bench"},
+        "TENANT_PROXIES": ["bench"],
+    }
+    if args.config:
+        with open(args.config) as f:
+            server_config.update(json.load(f))
+
+    config_path = Path(scratch.name) / "config.json"
+    with open(config_path, "w") as f:
+        json.dump(server_config, f)
+
+    mix = parse_mix(args.mix)
+    proc = start_server(args, config_path)
+    try:
+        result = drive(f"http://127.0.0.1:{args.port}/api/query", mix,
+                       args.concurrency, args.requests, args.warmup, args.seed)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+        scratch.cleanup()
+
+    commit = git_commit()
+    result.update({
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("db_password", "output", "compare")},
+        "mix": mix,
+    })
+
+    output = Path(args.output) if args.output else BACKEND_DIR / "bench_results" / f"{commit or 'unknown'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    logger.info(f"Saved results to {output}")
+
+    print(f"throughput: {result['throughput_rps']:.2f} req/s  statuses: {result['statuses']}")
+    for stage, stats in result["stages_ms"].items():
+        print(f"{stage:>16}: p50={stats['p50']:.1f}ms p95={stats['p95']:.1f}ms p99={stats['p99']:.1f}ms")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f), result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import argparse
+import io
+import logging
+import random
+from datetime import datetime, timedelta
+
+import psycopg2
+
+from app.notifications import versions_sql
+from app.partitions import GRANULARITIES, migrate, prepare_load
+
+logger = logging.getLogger(__name__)
+# Seeding drops and recreates sales and employees, so it targets its own database by default.
+BENCH_DB = "agent_plot_bench"
+
+ITEM_NAMES = [
+    "Laptop", "Monitor", "Keyboard", "Mouse", "Webcam", "Desk", "Chair", "Tablet",
+    "Printer", "Docking Station", "Smartphone", "Router", "Projector", "Scanner",
+    "Microphone", "Speaker", "External Hard Drive", "Flash Drive", "Graphics Card",
+    "RAM", "SSD", "Power Supply", "Motherboard", "Cooling Fan", "Surge Protector"
+]
+FIRST_NAMES = ["Rahul", "Liam", "James", "Aria", "Canary", "Trevin", "Mark", "Elijah",
+               "Mason", "Zoe", "Ethan", "Pareek", "Sophia", "Luna", "Grace", "Nathan"]
+
+DDL = """
+DROP TABLE IF EXISTS sales;
+DROP TABLE IF EXISTS employees;
+CREATE TABLE employees (
+    employee_id INTEGER PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE sales (
+    id BIGINT PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
+    item_name TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    amount NUMERIC(10, 2) NOT NULL,
+    sale_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    employee_id INTEGER NOT NULL
+);
+"""
+
+
+def _timestamp(rng, start, seconds):
+    return (start + timedelta(seconds=rng.randint(0, seconds))).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def seed(conn, employees=1000, sales_per_employee=5, start="2025-05-15", end="2025-06-01", seed=42,
+         partition_by=None):
+    rng = random.Random(seed)
+    start_dt = datetime.strptime(start, "%Y-%m-%d")
+    end_dt = datetime.strptime(end, "%Y-%m-%d")
+    seconds = int((end_dt - start_dt).total_seconds())
+
+    with conn.cursor() as cur:
+        cur.execute(DDL)
+    if partition_by:
+        # Partitioned while still empty; COPY through sales then routes each row.
+        migrate(conn, partition_by, ahead=0)
+    with conn.cursor() as cur:
+        prepare_load(cur, [start_dt, end_dt])
+
+        buf = io.StringIO()
+        for emp_id in range(100, 100 + employees):
+            buf.write(f"{emp_id}\t{rng.choice(FIRST_NAMES)}\t{rng.choice(FIRST_NAMES)}\t{_timestamp(rng, start_dt, seconds)}\n")
+        buf.seek(0)
+        cur.copy_expert("COPY employees (employee_id, first_name, last_name, created_date) FROM STDIN", buf)
+
+        # Stream sales in chunks so large scales don't build one giant buffer.
+        sale_id = 1
+        buf = io.StringIO()
+        for emp_id in range(100, 100 + employees):
+            for _ in range(sales_per_employee):
+                buf.write(f"{sale_id}\t{rng.choice(ITEM_NAMES)}\t{rng.randint(1, 10)}\t"
+                          f"{rng.uniform(20.00, 1000.00):.2f}\t{_timestamp(rng, start_dt, seconds)}\t{emp_id}\n")
+                sale_id += 1
+            if buf.tell() > 8 * 1024 * 1024:
+                buf.seek(0)
+                cur.copy_expert("COPY sales (id, item_name, quantity, amount, sale_date, employee_id) FROM STDIN", buf)
+                buf = io.StringIO()
+        buf.seek(0)
+        cur.copy_expert("COPY sales (id, item_name, quantity, amount, sale_date, employee_id) FROM STDIN", buf)
+        # Explicit ids don't advance the identity sequences; loaders inserting afterwards need them to.
+        cur.execute("SELECT setval(pg_get_serial_sequence('employees', 'employee_id'), max(employee_id)) FROM employees")
+        cur.execute("SELECT setval(pg_get_serial_sequence('sales', 'id'), max(id)) FROM sales")
+        cur.execute(versions_sql())
+        cur.execute("ANALYZE employees; ANALYZE sales;")
+    conn.commit()
+    logger.info(f"Seeded {employees} employees and {sale_id - 1} sales.")
+    return sale_id - 1
+
+
+def add_db_args(parser):
+    parser.add_argument("--db-host", default="localhost")
+    parser.add_argument("--db-port", default="5432")
+    parser.add_argument("--db-name", default=BENCH_DB, help=f"created when missing (default {BENCH_DB})")
+    parser.add_argument("--db-user", default="postgres")
+    parser.add_argument("--db-password", default="")
+    parser.add_argument("--yes-drop", action="store_true",
+                        help=f"allow seeding a database other than {BENCH_DB} (drops its sales and employees)")
+
+
+def connect(args, dbname=None):
+    return psycopg2.connect(host=args.db_host, port=args.db_port, dbname=dbname or args.db_name,
+                            user=args.db_user, password=args.db_password)
+
+
+def connect_for_seed(args):
+    # Refuses to drop tables outside the bench database unless --yes-drop was given.
+    if args.db_name != BENCH_DB and not args.yes_drop:
+        raise SystemExit(f"Seeding drops the sales and employees tables in {args.db_name!r}; "
+                         f"use the default --db-name {BENCH_DB} or pass --yes-drop.")
+    if args.db_name == BENCH_DB:
+        conn = connect(args, dbname="postgres")
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (BENCH_DB,))
+                if cur.fetchone() is None:
+                    cur.execute(f"CREATE DATABASE {BENCH_DB}")
+                    logger.info(f"Created database {BENCH_DB}.")
+        finally:
+            conn.close()
+    return connect(args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed employees/sales tables at a given scale.")
+    add_db_args(parser)
+    parser.add_argument("--employees", type=int, default=1000)
+    parser.add_argument("--sales-per-employee", type=int, default=5)
+    parser.add_argument("--start", default="2025-05-15")
+    parser.add_argument("--end", default="2025-06-01")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--partition-by", choices=GRANULARITIES, help="range-partition sales on sale_date")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    conn = connect_for_seed(args)
+    try:
+        seed(conn, args.employees, args.sales_per_employee, args.start, args.end, args.seed, args.partition_by)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
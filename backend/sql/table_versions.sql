@@ -0,0 +1,32 @@
+-- Exact per-table data versions used for /api/query ETags.
+-- Every statement that changes employees or sales bumps that table's version
+-- and, on commit, notifies the channel named in the trigger's argument
+-- (table_changes, CHANGE_NOTIFY_CHANNEL's default). For another channel run
+-- python -m app.notifications install, which uses the configured one.
+
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+DECLARE
+    new_version BIGINT;
+BEGIN
+    INSERT INTO table_versions (table_name, version) VALUES (TG_TABLE_NAME, 1)
+    ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1
+    RETURNING version INTO new_version;
+    PERFORM pg_notify(COALESCE(TG_ARGV[0], 'table_changes'), json_build_object('table', TG_TABLE_NAME, 'version', new_version)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS employees_version ON employees;
+CREATE TRIGGER employees_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON employees
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version('table_changes');
+
+DROP TRIGGER IF EXISTS sales_version ON sales;
+CREATE TRIGGER sales_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON sales
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version('table_changes');
+
+INSERT INTO table_versions (table_name) VALUES ('employees'), ('sales') ON CONFLICT DO NOTHING;
@@ -1,8 +1,10 @@
 import dash
 import dash_bootstrap_components as dbc
+import logging
 from layout import layout
 from callbacks import register_callbacks
 
+logging.basicConfig(level=logging.INFO)
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 app.title = "Responsive Sales Dashboard"
 app.layout = layout
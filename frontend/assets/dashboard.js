@@ -0,0 +1,52 @@
+/* assets/dashboard.js */
+
+/* Browser-only dashboard work: the session id, KPI texts, table column
+   headers and CSV export of the rows currently visible in the table (after
+   its sorting and filtering). None of these need the Python server. */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    dashboard: {
+        session: function (config, current) {
+            if (current) {
+                return window.dash_clientside.no_update;
+            }
+            if (window.crypto && window.crypto.randomUUID) {
+                return window.crypto.randomUUID();
+            }
+            return Date.now().toString(36) + Math.random().toString(36).slice(2);
+        },
+
+        kpis: function (store) {
+            if (!store || !store.kpi) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            return [store.kpi.total, store.kpi.average];
+        },
+
+        columns: function (rows, current) {
+            var ids = rows && rows.length ? Object.keys(rows[0]) : [];
+            if (current && current.map(function (c) { return c.id; }).join() === ids.join()) {
+                return window.dash_clientside.no_update;
+            }
+            return ids.map(function (id) {
+                var name = id.replace(/_/g, " ").replace(/\b\w/g, function (c) { return c.toUpperCase(); });
+                return {name: name, id: id};
+            });
+        },
+
+        download: function (clicks, rows) {
+            if (!rows || !rows.length) {
+                return window.dash_clientside.no_update;
+            }
+            var ids = Object.keys(rows[0]);
+            var cell = function (value) {
+                var text = value === null || value === undefined ? "" : String(value);
+                return /[",\n]/.test(text) ? '"' + text.replace(/"/g, '""') + '"' : text;
+            };
+            var lines = [ids.map(cell).join(",")];
+            rows.forEach(function (row) {
+                lines.push(ids.map(function (id) { return cell(row[id]); }).join(","));
+            });
+            return {content: lines.join("\n") + "\n", filename: "filtered_product_sales.csv", type: "text/csv"};
+        }
+    }
+});
@@ -0,0 +1,52 @@
+/* assets/live_updates.js */
+
+/* Subscribes to the backend's /ws/changes feed and writes the tables that
+   changed into the table-changes store. Events are merged until the feed has
+   been quiet for debounce_ms, so a bulk load causes one refresh, not hundreds. */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    live: {
+        connect: function (config) {
+            if (!config || !config.url || window._liveSocket) {
+                return window.dash_clientside.no_update;
+            }
+            var pending = {};
+            var timer = null;
+            var retryMs = 1000;
+
+            function flush() {
+                timer = null;
+                var tables = Object.keys(pending);
+                pending = {};
+                if (tables.length) {
+                    window.dash_clientside.set_props("table-changes", {data: {tables: tables, at: Date.now()}});
+                }
+            }
+
+            function open() {
+                var socket = new WebSocket(config.url);
+                window._liveSocket = socket;
+                socket.onopen = function () {
+                    retryMs = 1000;
+                    window.dash_clientside.set_props("live-status", {children: "● Live"});
+                };
+                socket.onmessage = function (event) {
+                    var message = JSON.parse(event.data);
+                    if (message.type !== "changes") {
+                        return;
+                    }
+                    Object.keys(message.tables).forEach(function (table) { pending[table] = true; });
+                    clearTimeout(timer);
+                    timer = setTimeout(flush, config.debounce_ms || 1000);
+                };
+                socket.onclose = function () {
+                    window.dash_clientside.set_props("live-status", {children: "○ Offline"});
+                    setTimeout(open, retryMs);
+                    retryMs = Math.min(retryMs * 2, 30000);
+                };
+            }
+
+            open();
+            return "○ Connecting";
+        }
+    }
+});
@@ -1,122 +1,170 @@
-from dash import Input, Output, State, callback_context, no_update, dcc
-import pandas as pd
-import plotly.express as px
+from dash import Input, Output, State, ClientsideFunction, Patch, callback_context, no_update
 from data import fetch_data
+import hashlib
+import json
+
+
+def _digest(value):
+    return hashlib.md5(json.dumps(value, default=str, sort_keys=True).encode()).hexdigest()
+
+
+def summarize(df):
+    # KPI texts, chart series and table rows for one query result.
+    total = df['total_products_sold'].sum() if not df.empty else 0
+    avg = round(df['total_products_sold'].mean(), 2) if not df.empty else 0
+    kpi = {"total": str(total), "average": str(avg)}
+    margins = None
+    if 'total_products_sold_margin' in df.columns and not df.empty:
+        # Sampled estimate: groups are independent, so margins add in quadrature.
+        margin = (df['total_products_sold_margin'].fillna(0) ** 2).sum() ** 0.5
+        kpi = {"total": f"≈ {total:,.0f} ± {margin:,.0f}", "average": f"≈ {avg:,.2f} ± {margin / len(df):,.2f}"}
+        margins = df['total_products_sold_margin']
+
+    bar = {"x": [], "y": [], "error": None}
+    donut = {"labels": [], "values": []}
+    if not df.empty:
+        order = df['total_products_sold'].sort_values(ascending=True).index
+        bar = {
+            "x": df.loc[order, 'total_products_sold'].tolist(),
+            "y": df.loc[order, 'full_name'].tolist(),
+            "error": margins.loc[order].fillna(0).tolist() if margins is not None else None,
+        }
+        if 'product_list' in df.columns:
+            products = df[['product_list', 'total_products_sold']].copy()
+            products['product_list'] = products['product_list'].apply(lambda x: x if isinstance(x, list) else [x])
+            products = products.explode('product_list')
+            products = products[products['product_list'].notnull()]
+            grouped = products.groupby('product_list', as_index=False)['total_products_sold'].sum()
+            donut = {"labels": grouped['product_list'].tolist(), "values": grouped['total_products_sold'].tolist()}
+
+    table = df.drop(columns=[c for c in df.columns if c.endswith('_margin')])
+    if 'product_list' in table.columns:
+        table['product_list'] = table['product_list'].apply(
+            lambda x: ", ".join(str(i) if i is not None else '' for i in x) if isinstance(x, list) else x
+        )
+    if 'created_date' in table.columns and not table.empty:
+        table['created_date'] = table['created_date'].dt.strftime('%Y-%m-%d')
+    return kpi, bar, donut, table.to_dict('records')
+
+
+def bar_patch(bar):
+    patch = Patch()
+    patch["data"][0]["x"] = bar["x"]
+    patch["data"][0]["y"] = bar["y"]
+    patch["data"][0]["text"] = bar["x"]
+    patch["data"][0]["error_x"] = {"type": "data", "array": bar["error"] or [], "visible": bool(bar["error"])}
+    return patch
+
+
+def donut_patch(donut):
+    patch = Patch()
+    patch["data"][0]["labels"] = donut["labels"]
+    patch["data"][0]["values"] = donut["values"]
+    return patch
+
+
+def publish(df, previous):
+    # Table rows, the dashboard-data store (KPIs and digests of what is shown)
+    # and Patches for the two charts. Anything whose digest matches the
+    # previous result is no_update, so unchanged parts aren't resent.
+    kpi, bar, donut, rows = summarize(df)
+    digests = {"bar": _digest(bar), "donut": _digest(donut), "table": _digest(rows)}
+    before = (previous or {}).get("digests", {})
+    store = {"kpi": kpi, "digests": digests}
+    return (rows if digests["table"] != before.get("table") else no_update,
+            store,
+            bar_patch(bar) if digests["bar"] != before.get("bar") else no_update,
+            donut_patch(donut) if digests["donut"] != before.get("donut") else no_update)
+
 
 def register_callbacks(app):
+    # Opens the /ws/changes socket once; see assets/live_updates.js.
+    app.clientside_callback(
+        ClientsideFunction(namespace='live', function_name='connect'),
+        Output('live-status', 'children'),
+        Input('live-config', 'data')
+    )
+
+    # Pure UI work stays in the browser; see assets/dashboard.js.
+    app.clientside_callback(
+        ClientsideFunction(namespace='dashboard', function_name='session'),
+        Output('session-id', 'data'),
+        Input('live-config', 'data'),
+        State('session-id', 'data')
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace='dashboard', function_name='kpis'),
+        Output('kpi-total', 'children'),
+        Output('kpi-average', 'children'),
+        Input('dashboard-data', 'data'),
+        prevent_initial_call=True
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace='dashboard', function_name='columns'),
+        Output('data-table', 'columns'),
+        Input('data-table', 'data'),
+        State('data-table', 'columns'),
+        prevent_initial_call=True
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace='dashboard', function_name='download'),
+        Output('download-data', 'data'),
+        Input('download-btn', 'n_clicks'),
+        State('data-table', 'derived_virtual_data'),
+        prevent_initial_call=True
+    )
+
     @app.callback(
-        [Output('kpi-total', 'children'),
-         Output('kpi-average', 'children'),
+        [Output('data-table', 'data'),
+         Output('dashboard-data', 'data'),
          Output('bar-chart', 'figure'),
          Output('donut-chart', 'figure'),
-         Output('data-table', 'data'),
-         Output('data-table', 'columns'),
-         Output('download-data', 'data')],
+         Output('active-query', 'data'),
+         Output('refine-request', 'data')],
         [Input('filter-btn', 'n_clicks'),
-         Input('download-btn', 'n_clicks')],
+         Input('table-changes', 'data')],
         [State('search-input', 'value'),
          State('start-date', 'date'),
          State('end-date', 'date'),
-         State('data-table', 'data'),
-         State('data-table', 'columns')],
+         State('active-query', 'data'),
+         State('approx-switch', 'value'),
+         State('dashboard-data', 'data'),
+         State('session-id', 'data')],
         prevent_initial_call=True
     )
-    def universal_callback(filter_clicks, download_clicks,
-                           search_text, start_date, end_date, table_data, table_columns):
-
+    def load_data(filter_clicks, changes, search_text, start_date, end_date, active, approx, previous, session):
         triggered_id = callback_context.triggered[0]['prop_id'].split('.')[0]
 
-        # Default outputs
-        empty_fig = {}
-        empty_str = ""
-        no_download = no_update
-
-        # If Apply Filters clicked: update dashboard with fresh data
-        if triggered_id == 'filter-btn':
-            df = fetch_data(search_text, start_date, end_date)
-            total = df['total_products_sold'].sum() if not df.empty else 0
-            avg = round(df['total_products_sold'].mean(), 2) if not df.empty else 0
-
-            if not df.empty:
-                df_sorted = df.sort_values(by='total_products_sold', ascending=True)
-
-                bar_fig = px.bar(
-                    df_sorted,
-                    x='total_products_sold',
-                    y='full_name',
-                    orientation='h',
-                    title="Products Sold by Employee",
-                    labels={"full_name": "Employee", "total_products_sold": "Units Sold"},
-                    text='total_products_sold'
-                )
-
-                bar_fig.update_traces(
-                    textposition='outside',
-                    marker_line_color="#8fafe7",
-                    marker_line_width=1.5,
-                    hovertemplate='<b>%{y}</b><br>Units Sold: %{x}<extra></extra>'
-                )
-
-                bar_fig.update_layout(
-                    yaxis=dict(autorange="reversed"),
-                    xaxis_title="Units Sold",
-                    yaxis_title="Employee",
-                    plot_bgcolor='white',
-                    paper_bgcolor='white',
-                    font=dict(size=14),
-                    margin=dict(t=60, l=160, r=40, b=50),
-                    hovermode="y unified",
-                    uniformtext_minsize=12,
-                    uniformtext_mode='hide'
-                )
-
-                bar_fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='#4A7592')
-                bar_fig.update_yaxes(showgrid=False)
-
-                if 'product_list' in df.columns:
-                    df['product_list'] = df['product_list'].apply(
-                        lambda x: x if isinstance(x, list) else [x]
-                    )
-                    df_exploded = df.explode('product_list')
-                    filtered_df = df_exploded[df_exploded['product_list'].notnull()]
-                    grouped_df = filtered_df.groupby('product_list', as_index=False)['total_products_sold'].sum()
-
-                    donut_fig = px.pie(
-                        grouped_df,
-                        names='product_list',
-                        values='total_products_sold',
-                        title="Sales Distribution by Product",
-                        hole=0.4,
-                        color_discrete_sequence=px.colors.sequential.GnBu
-                    ) if not grouped_df.empty else {}
-                else:
-                    donut_fig = {}
-
-                if 'product_list' in df.columns:
-                    df['product_list'] = df['product_list'].apply(
-                        lambda x: ", ".join(str(i) if i is not None else '' for i in x) if isinstance(x, list) else x
-                    )
-                if 'created_date' in df.columns:
-                    df['created_date'] = df['created_date'].dt.strftime('%Y-%m-%d')
-
-            else:
-                bar_fig = {}
-                donut_fig = {}
-
-            columns = [{"name": col.replace("_", " ").title(), "id": col} for col in df.columns]
-            data = df.to_dict('records')
-
-            return str(total), str(avg), bar_fig, donut_fig, data, columns, no_download
-
-        # If Download clicked: send CSV file of current table data
-        elif triggered_id == 'download-btn':
-            if table_data:
-                df = pd.DataFrame(table_data)
-                return no_update, no_update, no_update, no_update, no_update, no_update, \
-                    dcc.send_data_frame(df.to_csv, "filtered_product_sales.csv", index=False)
-            else:
-                # No data to download; no change to outputs
-                return no_update, no_update, no_update, no_update, no_update, no_update, no_download
-
-        # Default fallback (shouldn't happen)
-        return no_update, no_update, no_update, no_update, no_update, no_update, no_download
\ No newline at end of file
+        # Pushed change event: re-run the applied query only if it reads a changed table
+        if triggered_id == 'table-changes':
+            if not active or not set(changes["tables"]) & set(active["tables"]):
+                return (no_update,) * 6
+            search_text, start_date, end_date = active["query"], active["start"], active["end"]
+
+        approximate = bool(approx) and triggered_id == 'filter-btn'
+        # A change event means the cached copy is outdated; revalidate instead of trusting the TTL.
+        df = fetch_data(search_text, start_date, end_date, approximate=approximate,
+                        fresh=triggered_id == 'table-changes', user=session)
+        active = {"query": search_text, "start": start_date, "end": end_date,
+                  "tables": df.attrs.get("tables", [])}
+        # Estimates are shown right away and replaced by exact values once the refine callback finishes.
+        refine = active if df.attrs.get("approximate") == "sampled" else no_update
+        return (*publish(df, previous), active, refine)
+
+    @app.callback(
+        [Output('data-table', 'data', allow_duplicate=True),
+         Output('dashboard-data', 'data', allow_duplicate=True),
+         Output('bar-chart', 'figure', allow_duplicate=True),
+         Output('donut-chart', 'figure', allow_duplicate=True)],
+        Input('refine-request', 'data'),
+        [State('active-query', 'data'),
+         State('dashboard-data', 'data'),
+         State('session-id', 'data')],
+        prevent_initial_call=True
+    )
+    def refine_callback(request, active, previous, session):
+        # Exact values for an estimate shown earlier, unless a newer query replaced it meanwhile.
+        df = fetch_data(request["query"], request["start"], request["end"], user=session)
+        if active and (active["query"], active["start"], active["end"]) != (request["query"], request["start"], request["end"]):
+            return (no_update,) * 4
+        return publish(df, previous)
@@ -1 +1,18 @@
-API_URL = "http://0.0.0.0:8080/api/query"
\ No newline at end of file
+API_URL = "http://0.0.0.0:8080/api/query"
+BATCH_API_URL = "http://0.0.0.0:8080/api/batch"
+RESULTS_API_URL = "http://0.0.0.0:8080/api/results"
+# Sent as X-API-Key. Map it in the backend's TENANT_API_KEYS to a tenant listed in
+# TENANT_PROXIES so each browser session gets its own quota; empty sends no identity.
+API_KEY = ""
+# Shared keep-alive session for all backend calls (data.ApiClient).
+API_POOL_SIZE = 8
+API_CONNECT_TIMEOUT = 3.05
+API_READ_TIMEOUT = 120
+# Repeated prompts within this window are answered from the local cache;
+# older entries are revalidated with their ETag.
+API_CACHE_TTL_SECONDS = 30
+API_CACHE_MAX_ENTRIES = 128
+# Opened by the browser (assets/live_updates.js), so it must be reachable from there.
+CHANGES_WS_URL = "ws://localhost:8080/ws/changes"
+# Quiet period before a burst of change events triggers one refresh.
+LIVE_DEBOUNCE_MS = 1500
@@ -1,26 +1,137 @@
 import pandas as pd
 import requests
-from config import API_URL
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import (API_URL, BATCH_API_URL, RESULTS_API_URL, API_KEY, API_CONNECT_TIMEOUT, API_READ_TIMEOUT,
+                    API_POOL_SIZE, API_CACHE_TTL_SECONDS, API_CACHE_MAX_ENTRIES)
+import threading
+import logging
+import time
+import io
 
-def fetch_data(search_text, start_date, end_date):
-    print("Calling API with:", search_text, start_date, end_date)  # Debug print
-    try:
-        
-        if start_date and end_date:
-            search_text += f" from {start_date} to {end_date}"
-        elif start_date:
-            search_text += f" from {start_date}"
-        elif end_date:
-            search_text += f" up to {end_date}"        
-        payload = {"query": search_text or ""}
-        print("Payload for API:", payload)  # Debug print
-        headers = {"Content-Type": "application/json"}
-        response = requests.post(API_URL, json=payload, headers=headers)
-        print("API status code:", response.status_code)
+logger = logging.getLogger(__name__)
+
+
+class ApiClient:
+    # One keep-alive session for every backend call, with timeouts, a thread
+    # pool for fetching several panels at once, and a small TTL cache: within
+    # ttl a repeated request is answered locally, after that it is revalidated
+    # with If-None-Match and a 304 reuses the cached body. Calls made for a
+    # browser session carry its id as X-User, which the backend honours
+    # (as a tenant of its own) only alongside a proxy API key.
+    def __init__(self, pool_size=8, connect_timeout=3.05, read_timeout=120, ttl=30, max_entries=128,
+                 api_key=""):
+        self.session = requests.Session()
+        if api_key:
+            self.session.headers["X-API-Key"] = api_key
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="api")
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
 
+    @staticmethod
+    def _identity(user):
+        return {"X-User": user} if user else {}
+
+    def post_cached(self, url, payload, key, fresh=False, user=None):
+        # (status, body, headers). fresh skips the TTL (e.g. after a change
+        # event) but still revalidates, so an unchanged result costs a 304.
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        if cached and not fresh and time.monotonic() - cached["at"] < self.ttl:
+            return 200, cached["body"], cached["headers"]
+
+        headers = self._identity(user)
+        if cached and cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        response = self.session.post(url, json=payload, headers=headers, timeout=self.timeout)
+        logger.debug(f"POST {url} {response.status_code} Server-Timing: {response.headers.get('Server-Timing')}")
+        if response.status_code == 304 and cached:
+            cached["at"] = time.monotonic()
+            return 200, cached["body"], cached["headers"]
         response.raise_for_status()
-        data = response.json()
-        df = pd.DataFrame(data)
+        body = response.json()
+        if response.headers.get("ETag"):
+            # Servers may send header names in any case (uvicorn lowercases them).
+            with self._lock:
+                self._cache[key] = {"etag": response.headers["ETag"], "body": body,
+                                    "headers": CaseInsensitiveDict(response.headers), "at": time.monotonic()}
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return response.status_code, body, response.headers
+
+    def post(self, url, payload, user=None):
+        response = self.session.post(url, json=payload, headers=self._identity(user), timeout=self.timeout)
+        logger.debug(f"POST {url} {response.status_code} Server-Timing: {response.headers.get('Server-Timing')}")
+        response.raise_for_status()
+        return response.json()
+
+    def get(self, url, user=None):
+        response = self.session.get(url, headers=self._identity(user), timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def map(self, fn, items):
+        return list(self.executor.map(fn, items))
+
+
+API_CLIENT = ApiClient(API_POOL_SIZE, API_CONNECT_TIMEOUT, API_READ_TIMEOUT, API_CACHE_TTL_SECONDS,
+                       API_CACHE_MAX_ENTRIES, API_KEY)
+
+def with_date_range(search_text, start_date, end_date):
+    if start_date and end_date:
+        search_text += f" from {start_date} to {end_date}"
+    elif start_date:
+        search_text += f" from {start_date}"
+    elif end_date:
+        search_text += f" up to {end_date}"
+    return search_text
+
+def fetch_spilled(body, user=None):
+    # Results over the backend's memory budget are served by reference.
+    response = API_CLIENT.get(f"{RESULTS_API_URL}/{body['result_id']}", user=user)
+    if body["format"] == "parquet":
+        return pd.read_parquet(io.BytesIO(response.content))
+    return pd.read_json(io.BytesIO(response.content), lines=True)
+
+def to_frame(body, user=None):
+    # Builds typed columns straight from the backend's columnar envelope
+    # ("typed": true); plain row lists still work.
+    if isinstance(body, list):
+        return pd.DataFrame(body)
+    if body.get("spilled"):
+        return fetch_spilled(body, user)
+    columns = {}
+    for column in body["columns"]:
+        name, kind = column["name"], column["type"]
+        values = body["data"][name]
+        if kind in ("timestamp", "date"):
+            columns[name] = pd.to_datetime(values, format="ISO8601")
+        elif kind == "int" and None not in values:
+            columns[name] = pd.Series(values, dtype="int64")
+        elif kind in ("int", "float"):
+            columns[name] = pd.Series(values, dtype="float64")
+        else:
+            columns[name] = pd.Series(values, dtype="object")
+    return pd.DataFrame(columns)
+
+def fetch_data(search_text, start_date, end_date, approximate=False, fresh=False, user=None):
+    logger.debug(f"Fetching {search_text!r} from {start_date} to {end_date}")
+    try:
+        query = with_date_range(search_text, start_date, end_date) or ""
+        # Aggregates are refreshed from the new sales rows only when the backend can.
+        payload = {"query": query, "incremental": True, "approximate": approximate, "typed": True}
+        _, data, headers = API_CLIENT.post_cached(API_URL, payload, (query, approximate), fresh=fresh, user=user)
+        df = to_frame(data, user)
 
         if not df.empty:
             df['created_date'] = pd.to_datetime(df['created_date'])
@@ -29,7 +140,42 @@ def fetch_data(search_text, start_date, end_date):
                 df = df[df['created_date'] >= pd.to_datetime(start_date)]
             if end_date:
                 df = df[df['created_date'] <= pd.to_datetime(end_date)]
+        # Tables the query read; live updates only refresh for changes to these.
+        df.attrs["tables"] = [t for t in headers.get("X-Tables", "").split(",") if t]
+        df.attrs["approximate"] = headers.get("X-Approximate")
+        df.attrs["truncated"] = headers.get("X-Result-Overflow") == "truncated"
+        if df.attrs["truncated"]:
+            logger.warning(f"Result for {query!r} truncated by the backend's memory budget")
         return df
     except Exception as e:
-        print("API error:", e)
-        return pd.DataFrame()
\ No newline at end of file
+        logger.error(f"API error for {search_text!r}: {e}")
+        return pd.DataFrame()
+
+def fetch_many(panel_prompts, start_date=None, end_date=None, approximate=False, user=None):
+    # One /api/query per panel, in parallel on the client's pool; each panel
+    # gets the same caching and revalidation as fetch_data.
+    names = list(panel_prompts)
+    frames = API_CLIENT.map(
+        lambda name: fetch_data(panel_prompts[name], start_date, end_date, approximate=approximate, user=user),
+        names)
+    return dict(zip(names, frames))
+
+def fetch_batch(panel_prompts, start_date=None, end_date=None, user=None):
+    # One request for several dashboard panels; the backend generates all the
+    # SQL in one LLM call and runs the panels concurrently. Returns a
+    # DataFrame per panel (empty when that panel failed).
+    payload = {"panels": {name: {"query": with_date_range(prompt, start_date, end_date)}
+                          for name, prompt in panel_prompts.items()}}
+    try:
+        panels = API_CLIENT.post(BATCH_API_URL, payload, user=user)["panels"]
+    except Exception as e:
+        logger.error(f"Batch API error: {e}")
+        return {name: pd.DataFrame() for name in panel_prompts}
+
+    frames = {}
+    for name in panel_prompts:
+        result = panels.get(name, {})
+        if result.get("error"):
+            logger.error(f"Panel {name} error: {result['error']}")
+        frames[name] = pd.DataFrame(result.get("rows", []), columns=result.get("columns"))
+    return frames
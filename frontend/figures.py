@@ -0,0 +1,43 @@
+import plotly.express as px
+import plotly.graph_objects as go
+
+# The charts are created once with empty traces; callbacks then send only the
+# trace data through dash.Patch instead of whole figures.
+
+def bar_figure():
+    fig = go.Figure(go.Bar(
+        x=[], y=[], text=[],
+        orientation='h',
+        textposition='outside',
+        marker_line_color="#8fafe7",
+        marker_line_width=1.5,
+        hovertemplate='<b>%{y}</b><br>Units Sold: %{x}<extra></extra>'
+    ))
+
+    fig.update_layout(
+        title="Products Sold by Employee",
+        yaxis=dict(autorange="reversed"),
+        xaxis_title="Units Sold",
+        yaxis_title="Employee",
+        plot_bgcolor='white',
+        paper_bgcolor='white',
+        font=dict(size=14),
+        margin=dict(t=60, l=160, r=40, b=50),
+        hovermode="y unified",
+        uniformtext_minsize=12,
+        uniformtext_mode='hide'
+    )
+
+    fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='#4A7592')
+    fig.update_yaxes(showgrid=False)
+    return fig
+
+
+def donut_figure():
+    fig = go.Figure(go.Pie(
+        labels=[], values=[],
+        hole=0.4,
+        marker=dict(colors=px.colors.sequential.GnBu)
+    ))
+    fig.update_layout(title="Sales Distribution by Product")
+    return fig
@@ -1,6 +1,8 @@
 from dash import html, dcc, dash_table
 import plotly.express as px
 import dash_bootstrap_components as dbc
+from config import CHANGES_WS_URL, LIVE_DEBOUNCE_MS
+from figures import bar_figure, donut_figure
 
 input_style = {
     "height": "38px",  # Same as DateInput_input height in CSS
@@ -32,6 +34,17 @@ layout = dbc.Container([
         )
     ]),
 
+    # Live updates: the socket config, the tables the current view reads and
+    # the tables the backend reported as changed.
+    dcc.Store(id="live-config", data={"url": CHANGES_WS_URL, "debounce_ms": LIVE_DEBOUNCE_MS}),
+    dcc.Store(id="active-query"),
+    # Per-tab id sent to the backend as X-User (assets/dashboard.js).
+    dcc.Store(id="session-id", storage_type="session"),
+    dcc.Store(id="table-changes"),
+    dcc.Store(id="refine-request"),
+    dcc.Store(id="dashboard-data"),
+    html.Small(id="live-status", className="text-muted d-block text-end mb-2"),
+
     # Filters row aligned
     dbc.Row([
         dbc.Col([
@@ -42,6 +55,12 @@ layout = dbc.Container([
                 debounce=True,
                 placeholder="Type your query...",
                 style=input_style
+            ),
+            dbc.Switch(
+                id="approx-switch",
+                label="Fast estimates (refined in the background)",
+                value=False,
+                className="mt-1 small"
             )
         ], xs=12, md=4, className="d-flex flex-column justify-content-start"),
 
@@ -106,8 +125,8 @@ layout = dbc.Container([
 
     # Charts
     dbc.Row([
-        dbc.Col(dcc.Graph(id="bar-chart", config={"displayModeBar": False}), md=6),
-        dbc.Col(dcc.Graph(id="donut-chart", config={"displayModeBar": False}), md=6),
+        dbc.Col(dcc.Graph(id="bar-chart", figure=bar_figure(), config={"displayModeBar": False}), md=6),
+        dbc.Col(dcc.Graph(id="donut-chart", figure=donut_figure(), config={"displayModeBar": False}), md=6),
     ], className="mb-4"),
 
     # Data Table